@@ -1,18 +1,18 @@
-import sys, os
+import sys, os, time
+_T_IMPORT = time.perf_counter()
 import cv2
 import numpy as np
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QFileDialog, QVBoxLayout, QHBoxLayout,
     QPushButton, QSlider, QComboBox, QSpinBox, QGroupBox, QMessageBox, QAction, QCheckBox,
-    QFrame, QSplitter, QScrollArea
+    QFrame, QSplitter, QScrollArea, QRubberBand, QDialog
 )
-from PyQt5.QtCore import Qt, QPropertyAnimation, QEasingCurve, pyqtSignal
+from PyQt5.QtCore import Qt, QPropertyAnimation, QEasingCurve, pyqtSignal, QRect, QSize, QTimer
 from PyQt5.QtGui import QPixmap, QImage, QFont, QPalette, QIcon
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
-from . import filters as F
-from . import enhancement as E
 from . import utils as U
+from . import operations as O
+from . import compare as C
+from . import profiling as P
 
 def np_to_qpixmap(img_rgb: np.ndarray) -> QPixmap:
     h, w, ch = img_rgb.shape
@@ -20,14 +20,21 @@ def np_to_qpixmap(img_rgb: np.ndarray) -> QPixmap:
     qimg = QImage(img_rgb.data, w, h, bytes_per_line, QImage.Format_RGB888)
     return QPixmap.fromImage(qimg)
 
-class HistCanvas(FigureCanvas):
+class HistCanvas(QWidget):
+    # matplotlib is imported when the first canvas is built, not at startup
     def __init__(self, title="", parent=None):
+        super().__init__(parent)
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+        from matplotlib.figure import Figure
         fig = Figure(figsize=(5, 3), tight_layout=True, facecolor='#1e1e1e')
-        super().__init__(fig)
+        self.canvas = FigureCanvas(fig)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.canvas)
         self.ax = fig.add_subplot(111)
         self.ax.set_facecolor('#1e1e1e')
         self.title = title
-        self.setParent(parent)
+        P.register(FigureCanvas, 'draw', 'matplotlib.FigureCanvas.draw')
 
     def plot_hist(self, img_rgb: np.ndarray):
         self.ax.clear()
@@ -46,7 +53,7 @@ class HistCanvas(FigureCanvas):
         self.ax.tick_params(colors='white', labelsize=8)
         self.ax.grid(True, alpha=0.3, color='#555')
         self.ax.set_xlim(0, 255)
-        self.draw_idle()
+        self.canvas.draw_idle()
 
 class ImageLabel(QLabel):
     def __init__(self, on_drop_callback=None, title="", *args, **kwargs):
@@ -56,6 +63,34 @@ class ImageLabel(QLabel):
         self.title = title
         self.setMinimumHeight(300)
         self.setAlignment(Qt.AlignCenter)
+        self.on_roi_callback = None
+        self._rubber = None
+        self._origin = None
+
+    def enable_roi_selection(self, callback):
+        self.on_roi_callback = callback
+        self._rubber = QRubberBand(QRubberBand.Rectangle, self)
+
+    def mousePressEvent(self, event):
+        pix = self.pixmap()
+        if self.on_roi_callback and event.button() == Qt.LeftButton and pix is not None and not pix.isNull():
+            self._origin = event.pos()
+            self._rubber.setGeometry(QRect(self._origin, QSize()))
+            self._rubber.show()
+        super().mousePressEvent(event)
+
+    def mouseMoveEvent(self, event):
+        if self._origin is not None:
+            self._rubber.setGeometry(QRect(self._origin, event.pos()).normalized())
+        super().mouseMoveEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        if self._origin is not None:
+            rect = QRect(self._origin, event.pos()).normalized()
+            self._origin = None
+            self._rubber.hide()
+            self.on_roi_callback(rect)
+        super().mouseReleaseEvent(event)
         
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():
@@ -95,6 +130,27 @@ class ImageLabel(QLabel):
             font-size: 14px;
         """)
 
+class CompareDialog(QDialog):
+    def __init__(self, sheet: np.ndarray, total_ms: float, parent=None):
+        super().__init__(parent)
+        self.sheet = sheet
+        self.setWindowTitle(f'🧮 Compare all - {total_ms:.0f} ms')
+        self.resize(min(1200, sheet.shape[1] + 40), min(850, sheet.shape[0] + 90))
+        lbl = QLabel()
+        lbl.setPixmap(np_to_qpixmap(sheet))
+        scroll = QScrollArea()
+        scroll.setWidget(lbl)
+        scroll.setAlignment(Qt.AlignCenter)
+        btn_save = QPushButton('💾 Save sheet')
+        btn_save.clicked.connect(self.save_sheet)
+        layout = QVBoxLayout(self)
+        layout.addWidget(scroll, 1)
+        layout.addWidget(btn_save)
+
+    def save_sheet(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Save Contact Sheet', '', 'PNG (*.png);;JPEG (*.jpg *.jpeg)')
+        if path: U.save_image(path, self.sheet)
+
 class PhotoEditor(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -102,6 +158,7 @@ class PhotoEditor(QMainWindow):
         self.resize(1400, 900)
         self.img = None
         self.img_original = None
+        self.roi = None
         self.view_mode = 'fit'
         self.scale = 1.0
         self.build_ui()
@@ -113,12 +170,27 @@ class PhotoEditor(QMainWindow):
         open_act = QAction('📁 Open', self); open_act.triggered.connect(self.open_image)
         save_act = QAction('💾 Save As', self); save_act.triggered.connect(self.save_image)
         reset_act = QAction('🔄 Reset Image', self); reset_act.triggered.connect(self.reset_image)
+        clear_roi_act = QAction('⬚ Clear ROI', self); clear_roi_act.triggered.connect(self.clear_roi)
         menubar = self.menuBar(); file_menu = menubar.addMenu('File')
-        for a in (open_act, save_act, reset_act): file_menu.addAction(a)
+        for a in (open_act, save_act, reset_act, clear_roi_act): file_menu.addAction(a)
+
+        self.profile_act = QAction('⏱️ Enable profiling', self, checkable=True)
+        self.profile_act.setChecked(P.is_enabled())
+        self.profile_act.toggled.connect(self.toggle_profiling)
+        self.memory_act = QAction('🧠 Track memory allocations', self, checkable=True)
+        self.memory_act.setToolTip('Record bytes allocated per stage (tracemalloc, slower)')
+        self.memory_act.setChecked(P.is_tracking_memory())
+        self.memory_act.toggled.connect(self.toggle_memory_tracking)
+        export_act = QAction('📤 Export trace...', self); export_act.triggered.connect(self.export_trace)
+        clear_trace_act = QAction('🧹 Clear trace', self); clear_trace_act.triggered.connect(P.clear)
+        prof_menu = menubar.addMenu('Profiling')
+        for a in (self.profile_act, self.memory_act, export_act, clear_trace_act): prof_menu.addAction(a)
 
         # Image display area
         self.lbl_original = ImageLabel(on_drop_callback=self.load_path, title="Original")
         self.lbl_result   = ImageLabel(on_drop_callback=self.load_path, title="Result")
+        # drag a rectangle on the original to restrict processing to that region
+        self.lbl_original.enable_roi_selection(self.set_roi_from_label)
         
         # Set default text and style for image labels
         for lbl, name in [(self.lbl_original,'📸 Original'),(self.lbl_result,'✨ Result')]:
@@ -225,6 +297,9 @@ class PhotoEditor(QMainWindow):
                 }
             """)
         
+        self.chk_pyramid = QCheckBox('⚡ Multiscale blur (pyramid)')
+        self.chk_pyramid.setToolTip('Gaussian/Unsharp: xấp xỉ bằng pyramid, tốc độ gần như không đổi khi sigma lớn')
+
         self.chk_hist = QCheckBox('📈 Hiển thị Histogram')
         self.chk_hist.setStyleSheet("""
             QCheckBox {
@@ -249,6 +324,7 @@ class PhotoEditor(QMainWindow):
         buttons_data = [
             ('📁 Upload', self.open_image, '#22c55e'),
             ('✨ Apply', self.apply_operation, '#3b82f6'),
+            ('🧮 Compare all', self.compare_all, '#0ea5e9'),
             ('💾 Save', self.save_image, '#8b5cf6')
         ]
         
@@ -341,6 +417,7 @@ class PhotoEditor(QMainWindow):
         param_layout.addLayout(sigma_layout)
         param_layout.addLayout(thresh1_layout)
         param_layout.addLayout(thresh2_layout)
+        param_layout.addWidget(self.chk_pyramid)
         param_group.setLayout(param_layout)
         
         # Actions
@@ -374,13 +451,11 @@ class PhotoEditor(QMainWindow):
         right_panel.setLayout(ctrl_layout)
 
         # Histogram panel
+        # canvases are built on the first toggle_hist(True)
         self.hist_panel = QGroupBox('📊 Histogram Analysis')
-        vhist = QHBoxLayout()
-        self.hist_canvas_before = HistCanvas('Before', self)
-        self.hist_canvas_after  = HistCanvas('After', self)
-        vhist.addWidget(self.hist_canvas_before, 1)
-        vhist.addWidget(self.hist_canvas_after, 1)
-        self.hist_panel.setLayout(vhist)
+        self.hist_canvas_before = None
+        self.hist_canvas_after = None
+        self.hist_panel.setLayout(QHBoxLayout())
         self.hist_panel.setVisible(False)
         self.chk_hist.stateChanged.connect(lambda s: self.toggle_hist(s == Qt.Checked))
 
@@ -575,6 +650,7 @@ class PhotoEditor(QMainWindow):
             return
         self.img_original = img.copy()
         self.img = img.copy()
+        self.roi = None
         self.update_views()
 
     def save_image(self):
@@ -590,6 +666,31 @@ class PhotoEditor(QMainWindow):
             self.img = self.img_original.copy()
             self.update_views()
 
+    def set_roi_from_label(self, rect: QRect):
+        pix = self.lbl_original.pixmap()
+        if self.img_original is None or pix is None or pix.isNull():
+            return
+        if rect.width() < 3 or rect.height() < 3:
+            self.clear_roi()
+            return
+        # the pixmap is drawn centered inside the label's contents rect
+        cr = self.lbl_original.contentsRect()
+        ox = cr.x() + (cr.width() - pix.width()) / 2
+        oy = cr.y() + (cr.height() - pix.height()) / 2
+        sx = self.img_original.shape[1] / pix.width()
+        sy = self.img_original.shape[0] / pix.height()
+        roi = (int((rect.x() - ox) * sx), int((rect.y() - oy) * sy),
+               int(np.ceil(rect.width() * sx)), int(np.ceil(rect.height() * sy)))
+        try:
+            self.roi = U.clip_roi(roi, self.img_original.shape)
+        except ValueError:
+            self.roi = None
+        self.update_views()
+
+    def clear_roi(self):
+        self.roi = None
+        self.update_views()
+
     def _scaled_pixmap(self, img_rgb: np.ndarray, target_label: QLabel) -> QPixmap:
         pix = np_to_qpixmap(img_rgb)
         if self.view_mode == 'fit':
@@ -601,7 +702,13 @@ class PhotoEditor(QMainWindow):
 
     def update_views(self):
         if self.img_original is not None:
-            self.lbl_original.setPixmap(self._scaled_pixmap(self.img_original, self.lbl_original))
+            shown = self.img_original
+            if self.roi is not None:
+                x, y, w, h = self.roi
+                shown = self.img_original.copy()
+                thickness = max(2, min(shown.shape[:2]) // 300)
+                cv2.rectangle(shown, (x, y), (x + w - 1, y + h - 1), (255, 200, 0), thickness)
+            self.lbl_original.setPixmap(self._scaled_pixmap(shown, self.lbl_original))
         if self.img is not None:
             self.lbl_result.setPixmap(self._scaled_pixmap(self.img, self.lbl_result))
         if self.hist_panel.isVisible():
@@ -612,7 +719,15 @@ class PhotoEditor(QMainWindow):
         super().resizeEvent(event)
         self.update_views()
 
+    def ensure_hist_canvases(self):
+        if self.hist_canvas_before is None:
+            self.hist_canvas_before = HistCanvas('Before', self)
+            self.hist_canvas_after  = HistCanvas('After', self)
+            self.hist_panel.layout().addWidget(self.hist_canvas_before, 1)
+            self.hist_panel.layout().addWidget(self.hist_canvas_after, 1)
+
     def toggle_hist(self, show: bool):
+        if show: self.ensure_hist_canvases()
         self.hist_panel.setVisible(show)
         if show: self.update_views()
 
@@ -625,55 +740,91 @@ class PhotoEditor(QMainWindow):
         # Remove emoji from operation text for processing
         op = op_text.split(' ', 1)[-1] if ' ' in op_text else op_text
         
+        k, sigma, t1, t2, blur_mode = self.current_params()
+
+        with P.span(f'apply: {op}', self.img_original):
+            out = O.run_operation(op, self.img_original.copy(), k, sigma, t1, t2,
+                                  blur_mode=blur_mode, roi=self.roi)
+
+            self.img = out
+            self.update_views()
+            if P.is_enabled():
+                # flush the deferred pixmap paint and histogram draw into this span
+                QApplication.processEvents()
+        self.show_profile()
+
+    def current_params(self):
         k = int(self.spin_kernel.value())
         sigma = int(self.spin_sigma.value())
         t1 = int(self.slider_thresh1.value())
         t2 = int(self.slider_thresh2.value())
+        blur_mode = 'pyramid' if self.chk_pyramid.isChecked() else 'exact'
+        return k, sigma, t1, t2, blur_mode
 
-        img_rgb = self.img_original.copy()
-        img_gray = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2GRAY)
-
-        if op == 'Mean Blur':
-            out = F.mean_filter(img_rgb, k)
-        elif op == 'Gaussian Blur':
-            out = F.gaussian_filter(img_rgb, k, sigma)
-        elif op == 'Median Blur':
-            out = F.median_filter(img_rgb, k)
-        elif op == 'Bilateral':
-            out = F.bilateral_filter(img_rgb, d=max(3, k), sigmaColor=75, sigmaSpace=75)
-        elif op == 'Sharpen (Unsharp)':
-            out = E.unsharp_mask(img_rgb, k, sigma, amount=1.5, threshold=0)
-        elif op == 'Sharpen (Laplacian)':
-            sharp = E.laplacian_sharpen(img_gray)
-            out = cv2.cvtColor(sharp, cv2.COLOR_GRAY2RGB)
-        elif op == 'Edge: Sobel':
-            _, _, mag = F.sobel(img_gray)
-            out = cv2.cvtColor(mag, cv2.COLOR_GRAY2RGB)
-        elif op == 'Edge: Prewitt':
-            _, _, mag = F.prewitt(img_gray)
-            out = cv2.cvtColor(mag, cv2.COLOR_GRAY2RGB)
-        elif op == 'Edge: Laplacian':
-            lap = F.laplacian(img_gray)
-            out = cv2.cvtColor(lap, cv2.COLOR_GRAY2RGB)
-        elif op == 'Edge: Canny':
-            can = F.canny(img_gray, t1, t2)
-            out = cv2.cvtColor(can, cv2.COLOR_GRAY2RGB)
-        elif op == 'HistEq (global)':
-            he = E.hist_equalization(img_gray)
-            out = cv2.cvtColor(he, cv2.COLOR_GRAY2RGB)
-        elif op == 'CLAHE':
-            he = E.clahe_equalization(img_gray, clip_limit=2.0, tile_grid_size=(8,8))
-            out = cv2.cvtColor(he, cv2.COLOR_GRAY2RGB)
+    def compare_all(self):
+        if self.img_original is None:
+            QMessageBox.warning(self, 'Warning', 'Please open an image first.')
+            return
+        k, sigma, t1, t2, blur_mode = self.current_params()
+        with P.span('compare all', self.img_original):
+            result = C.compare_operations(self.img_original, k=k, sigma=sigma, t1=t1, t2=t2, blur_mode=blur_mode)
+            sheet = C.render_contact_sheet(result, original=self.img_original)
+        self.show_profile()
+        dlg = CompareDialog(sheet, result['total_ms'], self)
+        dlg.exec_()
+
+    def toggle_profiling(self, on: bool):
+        if on:
+            P.enable(track_memory=self.memory_act.isChecked())
+            self.statusBar().showMessage('Profiling enabled - apply an operation to see its breakdown')
         else:
-            out = img_rgb
-
-        self.img = out
-        self.update_views()
+            P.disable()
+            self.statusBar().clearMessage()
+
+    def toggle_memory_tracking(self, on: bool):
+        # tracemalloc is started/stopped by enable()/disable(), so re-enable
+        if P.is_enabled():
+            P.disable()
+            P.enable(track_memory=on)
+
+    def show_profile(self):
+        if P.is_enabled():
+            self.statusBar().showMessage(P.format_breakdown(P.last_breakdown()))
+
+    def export_trace(self):
+        if not P.events():
+            QMessageBox.information(self, 'Profiling', 'No trace recorded yet. Enable profiling and apply an operation.')
+            return
+        path, _ = QFileDialog.getSaveFileName(self, 'Export Trace', 'trace.json', 'Chrome trace (*.json)')
+        if path: P.export_chrome_trace(path)
+
+# Display paths traced while profiling is enabled
+P.register(sys.modules[__name__], 'np_to_qpixmap', 'app.np_to_qpixmap')
+P.register(HistCanvas, 'plot_hist', 'app.HistCanvas.plot_hist')
+P.register(PhotoEditor, '_scaled_pixmap', 'app.PhotoEditor.scaled_pixmap')
+P.register(PhotoEditor, 'update_views', 'app.PhotoEditor.update_views')
+
+def report_startup(app):
+    # used by `python -m src.benchmark startup`: one JSON line, then quit
+    import json
+    heavy = ('matplotlib', 'skimage')
+    print('STARTUP ' + json.dumps({
+        'window_ms': (time.perf_counter() - _T_IMPORT) * 1000.0,
+        'loaded': {m: m in sys.modules for m in heavy},
+    }), flush=True)
+    app.quit()
 
 def main():
+    profile = os.environ.get('PHOTO_EDITOR_PROFILE')
+    if profile:
+        # PHOTO_EDITOR_PROFILE=memory also records bytes allocated per stage
+        P.enable(track_memory=profile == 'memory')
     app = QApplication(sys.argv)
     w = PhotoEditor()
     w.show()
+    if os.environ.get('PHOTO_EDITOR_STARTUP_PROBE'):
+        # fires on the first event-loop turn, once the window has been shown
+        QTimer.singleShot(0, lambda: report_startup(app))
     sys.exit(app.exec_())
 
 if __name__ == '__main__':
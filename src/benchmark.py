@@ -0,0 +1,367 @@
+import argparse
+import glob
+import inspect
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+import cv2
+import numpy as np
+from . import filters as F
+from . import enhancement as E
+from . import metrics as M
+from . import utils as U
+
+# Reproducible benchmarks for every public function in filters, enhancement
+# and metrics, on the bundled data/ images and on synthetic inputs.
+#
+#   python -m src.benchmark run --out bench.json                 # full suite
+#   python -m src.benchmark run --quick --out bench.json         # 256..1024 only
+#   python -m src.benchmark compare baseline.json bench.json     # exit 1 on regression
+#   python -m src.benchmark startup --budget-ms 2500             # time to first window
+#
+# Each case gets `warmup` untimed calls, then `repeat` timed calls
+# (time.perf_counter). The peak is measured on one extra call with
+# tracemalloc, so it counts Python/NumPy allocations but not OpenCV's
+# internal buffers. The from-scratch convolutions are capped at
+# SLOW_MAX_PIXELS unless --include-slow is given.
+
+SIZES = {
+    '256': (256, 256), '512': (512, 512), '1K': (1024, 1024), '2K': (2048, 2048),
+    '4K': (2160, 3840), '8K': (4320, 7680),
+}
+QUICK_SIZES = ['256', '512', '1K']
+KSIZES = [3, 7, 15, 31]
+SLOW_MAX_PIXELS = 512 * 512
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+Spec = namedtuple('Spec', ['channels', 'params', 'build', 'max_pixels'])
+
+def spec(channels, params, build, max_pixels=None):
+    return Spec(channels, params, build, max_pixels)
+
+GRAY, RGB, BOTH = ('gray',), ('rgb',), ('gray', 'rgb')
+
+def _gradients(gray):
+    gx, gy = F.sobel_kernels()
+    return F.convolve2d_fast(gray, gx), F.convolve2d_fast(gray, gy)
+
+def _noisy(img):
+    rng = np.random.default_rng(1)
+    return np.clip(img.astype(np.float32) + rng.normal(0, 10, img.shape), 0, 255).astype(np.uint8)
+
+def _build_gradient_magnitude(img):
+    ix, iy = _gradients(img)
+    return lambda: F.gradient_magnitude(ix, iy)
+
+def _build_metric(fn, **kw):
+    def build(img):
+        other = _noisy(img)
+        return lambda: fn(img, other, **kw)
+    return build
+
+# `build(img, **params)` does any setup outside the timed region and returns
+# the zero-argument call to time.
+SPECS = {
+    'filters.mean_filter': spec(BOTH, [{'ksize': k} for k in KSIZES],
+                                lambda img, ksize: lambda: F.mean_filter(img, ksize)),
+    'filters.gaussian_filter': spec(BOTH, [{'ksize': k, 'sigma': k / 6.0} for k in KSIZES],
+                                    lambda img, ksize, sigma: lambda: F.gaussian_filter(img, ksize, sigma)),
+    'filters.pyramid_gaussian_filter': spec(BOTH, [{'sigma': s} for s in (2.0, 8.0, 32.0)],
+                                            lambda img, sigma: lambda: F.pyramid_gaussian_filter(img, sigma)),
+    'filters.median_filter': spec(BOTH, [{'ksize': k} for k in KSIZES],
+                                  lambda img, ksize: lambda: F.median_filter(img, ksize)),
+    'filters.bilateral_filter': spec(BOTH, [{'d': d} for d in (5, 9, 15)],
+                                     lambda img, d: lambda: F.bilateral_filter(img, d)),
+    'filters.convolve2d': spec(GRAY, [{}], lambda img: lambda: F.convolve2d(img, F.laplacian_kernel()),
+                               SLOW_MAX_PIXELS),
+    'filters.reflect_pad': spec(GRAY, [{'ksize': k} for k in KSIZES],
+                                lambda img, ksize: lambda: F.reflect_pad(img, ksize, ksize)),
+    'filters.convolve2d_fast': spec(GRAY, [{'ksize': k} for k in KSIZES],
+                                    lambda img, ksize: lambda: F.convolve2d_fast(
+                                        img, np.ones((ksize, ksize), np.float32) / ksize**2)),
+    'filters.gradient_magnitude': spec(GRAY, [{}], _build_gradient_magnitude),
+    'filters.sobel': spec(GRAY, [{}], lambda img: lambda: F.sobel(img), SLOW_MAX_PIXELS),
+    'filters.prewitt': spec(GRAY, [{}], lambda img: lambda: F.prewitt(img), SLOW_MAX_PIXELS),
+    'filters.laplacian': spec(GRAY, [{}], lambda img: lambda: F.laplacian(img), SLOW_MAX_PIXELS),
+    'filters.canny': spec(GRAY, [{}], lambda img: lambda: F.canny(img, 100, 200)),
+    'enhancement.unsharp_mask': spec(BOTH, [{'ksize': k} for k in KSIZES],
+                                     lambda img, ksize: lambda: E.unsharp_mask(img, ksize, ksize / 6.0)),
+    'enhancement.laplacian_sharpen': spec(GRAY, [{}], lambda img: lambda: E.laplacian_sharpen(img)),
+    'enhancement.hist_equalization': spec(GRAY, [{}], lambda img: lambda: E.hist_equalization(img)),
+    'enhancement.clahe_equalization': spec(GRAY, [{}], lambda img: lambda: E.clahe_equalization(img)),
+    'metrics.mse': spec(BOTH, [{}], _build_metric(M.mse)),
+    'metrics.psnr': spec(BOTH, [{}], _build_metric(M.psnr)),
+    'metrics.ssim': spec(BOTH, [{}], lambda img: _build_metric(M.ssim, multichannel=img.ndim == 3)(img)),
+    'metrics.ssim_stats': spec(BOTH, [{}], lambda img: lambda: M.ssim_stats(img)),
+}
+
+# Public functions that do not take an image (kernels, halo helpers, scalars)
+NOT_BENCHMARKED = {
+    'filters.ksize_halo', 'filters.gaussian_halo', 'filters.bilateral_halo', 'filters.ksize_to_sigma',
+    'filters.pyramid_levels', 'filters.pyramid_error', 'filters.sobel_kernels', 'filters.prewitt_kernels',
+    'filters.laplacian_kernel',
+    'metrics.get_ssim_fn',
+}
+
+def public_functions():
+    names = []
+    for mod in (F, E, M):
+        short = mod.__name__.rsplit('.', 1)[-1]
+        # unwrap so decorated functions (functools.lru_cache) are listed too
+        for name, obj in inspect.getmembers(mod, lambda o: inspect.isfunction(inspect.unwrap(o))):
+            if not name.startswith('_') and obj.__module__ == mod.__name__:
+                names.append(f'{short}.{name}')
+    return names
+
+def synthetic_image(h: int, w: int, channels: int=3, seed: int=0) -> np.ndarray:
+    # ramp + blobs + noise: enough structure for edges and histograms to matter
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    base = 127.5 + 60 * np.sin(xx / max(w, 1) * 6 * np.pi) * np.cos(yy / max(h, 1) * 4 * np.pi)
+    base += rng.normal(0, 12, (h, w))
+    img = np.clip(base, 0, 255).astype(np.uint8)
+    for _ in range(8):
+        x0, y0 = int(rng.integers(0, w)), int(rng.integers(0, h))
+        r = int(rng.integers(max(2, min(h, w) // 40), max(3, min(h, w) // 8)))
+        cv2.circle(img, (x0, y0), r, int(rng.integers(0, 256)), -1)
+    if channels == 3:
+        img = np.dstack([img, np.roll(img, w // 7, axis=1), np.roll(img, h // 5, axis=0)])
+    return np.ascontiguousarray(img)
+
+def inputs(sizes, use_data: bool=True):
+    # yields (source, channels, image)
+    if use_data:
+        for path in sorted(glob.glob(os.path.join(DATA_DIR, '*.jpg'))):
+            rgb = U.read_image(path)
+            source = os.path.relpath(path, os.path.dirname(DATA_DIR))
+            yield source, 'rgb', rgb
+            yield source, 'gray', cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    for label in sizes:
+        h, w = SIZES[label]
+        yield f'synthetic:{label}', 'rgb', synthetic_image(h, w, 3)
+        yield f'synthetic:{label}', 'gray', synthetic_image(h, w, 1)
+
+def measure(call, warmup: int, repeat: int) -> dict:
+    for _ in range(warmup):
+        call()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        call()
+        times.append((time.perf_counter() - t0) * 1000.0)
+    tracemalloc.start()
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'min_ms': min(times), 'median_ms': statistics.median(times), 'mean_ms': statistics.fmean(times),
+        'stdev_ms': statistics.stdev(times) if len(times) > 1 else 0.0, 'repeat': repeat,
+        'peak_alloc_bytes': int(peak),
+    }
+
+def case_key(c: dict) -> str:
+    params = ','.join(f'{k}={v}' for k, v in sorted(c['params'].items()))
+    return f"{c['func']}|{c['source']}|{c['channels']}|{params}"
+
+def run(sizes, funcs=None, warmup: int=1, repeat: int=5, use_data: bool=True, include_slow: bool=False,
+        log=print) -> dict:
+    missing = [n for n in public_functions() if n not in SPECS and n not in NOT_BENCHMARKED]
+    for name in missing:
+        log(f'warning: no benchmark spec for public function {name}')
+    selected = {n: s for n, s in SPECS.items() if not funcs or n in funcs or n.split('.', 1)[1] in funcs}
+    results = []
+    for source, channels, img in inputs(sizes, use_data):
+        npix = img.shape[0] * img.shape[1]
+        for name, sp in selected.items():
+            if channels not in sp.channels:
+                continue
+            if sp.max_pixels and npix > sp.max_pixels and not include_slow:
+                continue
+            for params in sp.params:
+                call = sp.build(img, **params)
+                stats = measure(call, warmup, repeat)
+                c = {'func': name, 'source': source, 'channels': channels, 'shape': list(img.shape),
+                     'params': params, **stats,
+                     'mpix_per_s': npix / 1e6 / (stats['median_ms'] / 1000.0) if stats['median_ms'] > 0 else None}
+                c['key'] = case_key(c)
+                results.append(c)
+                log(f"{name:34s} {source:28s} {channels:4s} {str(params):22s} {stats['median_ms']:10.3f} ms")
+    return {'meta': environment(), 'config': {'sizes': list(sizes), 'warmup': warmup, 'repeat': repeat,
+            'use_data': use_data, 'include_slow': include_slow, 'funcs': sorted(selected)},
+            'results': results}
+
+def environment() -> dict:
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+        'platform': platform.platform(), 'machine': platform.machine(), 'cpu_count': os.cpu_count(),
+        'numpy': np.__version__, 'opencv': cv2.__version__, 'opencv_threads': cv2.getNumThreads(),
+        'skimage': M.get_ssim_fn() is not None,
+    }
+
+def compare(baseline: dict, current: dict, threshold: float=0.10, min_ms: float=0.05) -> dict:
+    # A case regresses when its median is more than `threshold` slower than
+    # the baseline; cases faster than min_ms are too noisy to judge.
+    base = {c['key']: c for c in baseline['results']}
+    rows = []
+    for c in current['results']:
+        b = base.get(c['key'])
+        if b is None:
+            continue
+        ratio = c['median_ms'] / b['median_ms'] if b['median_ms'] > 0 else float('inf')
+        if max(c['median_ms'], b['median_ms']) < min_ms:
+            status = 'noise'
+        elif ratio > 1.0 + threshold:
+            status = 'regression'
+        elif ratio < 1.0 / (1.0 + threshold):
+            status = 'improvement'
+        else:
+            status = 'same'
+        rows.append({'key': c['key'], 'baseline_ms': b['median_ms'], 'current_ms': c['median_ms'],
+                     'ratio': ratio, 'status': status})
+    cur_keys = {c['key'] for c in current['results']}
+    return {'rows': rows,
+            'regressions': [r for r in rows if r['status'] == 'regression'],
+            'missing': sorted(k for k in base if k not in cur_keys),
+            'new': sorted(k for k in cur_keys if k not in base)}
+
+def print_comparison(report: dict, verbose: bool=False):
+    for r in report['rows']:
+        if verbose or r['status'] in ('regression', 'improvement'):
+            print(f"{r['status']:12s} x{r['ratio']:6.2f}  {r['baseline_ms']:10.3f} -> {r['current_ms']:10.3f} ms  {r['key']}")
+    print(f"{len(report['rows'])} compared, {len(report['regressions'])} regressions, "
+          f"{len(report['missing'])} missing, {len(report['new'])} new")
+
+# ---------- Startup time ----------
+# Spawns `python -m src.app` with PHOTO_EDITOR_STARTUP_PROBE=1; the app prints
+# one STARTUP line on its first event-loop turn after show() and quits. The
+# clock runs from spawn to that line, so interpreter start-up and imports are
+# included. Heavy modules that should stay lazy are reported as well.
+LAZY_MODULES = ('matplotlib', 'skimage')
+REPO_ROOT = os.path.dirname(DATA_DIR)
+
+def measure_startup(runs: int=5, offscreen: bool=True, timeout: float=60.0, log=print) -> dict:
+    env = dict(os.environ, PHOTO_EDITOR_STARTUP_PROBE='1')
+    if offscreen:
+        env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    samples = []
+    for i in range(runs):
+        t0 = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, '-m', 'src.app'], cwd=REPO_ROOT, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        report = None
+        try:
+            for line in proc.stdout:
+                if line.startswith('STARTUP '):
+                    wall_ms = (time.perf_counter() - t0) * 1000.0
+                    report = json.loads(line[len('STARTUP '):])
+                    report['first_window_ms'] = wall_ms
+                    break
+            proc.wait(timeout=timeout)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+        if report is None:
+            raise RuntimeError(f'app exited without a startup report:\n{proc.stderr.read()}')
+        samples.append(report)
+        log(f"run {i + 1}: first window {report['first_window_ms']:.1f} ms "
+            f"(imports+init {report['window_ms']:.1f} ms) loaded={report['loaded']}")
+    first = [r['first_window_ms'] for r in samples]
+    return {
+        'meta': environment(), 'runs': samples,
+        'median_ms': statistics.median(first), 'min_ms': min(first), 'max_ms': max(first),
+        'eager_modules': sorted({m for r in samples for m, on in r['loaded'].items() if on}),
+    }
+
+def check_startup(result: dict, budget_ms: float=None, baseline: dict=None, threshold: float=0.10) -> list:
+    problems = []
+    if result['eager_modules']:
+        problems.append(f"loaded at startup but should be lazy: {', '.join(result['eager_modules'])}")
+    if budget_ms is not None and result['median_ms'] > budget_ms:
+        problems.append(f"median time to first window {result['median_ms']:.1f} ms exceeds budget {budget_ms:.1f} ms")
+    if baseline is not None and result['median_ms'] > baseline['median_ms'] * (1.0 + threshold):
+        problems.append(f"median {result['median_ms']:.1f} ms is more than {threshold:.0%} "
+                        f"slower than baseline {baseline['median_ms']:.1f} ms")
+    return problems
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark filters, enhancement and metrics')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_run = sub.add_parser('run')
+    p_run.add_argument('--out', default='bench.json')
+    p_run.add_argument('--sizes', default=','.join(SIZES), help=f'comma list of {list(SIZES)}')
+    p_run.add_argument('--quick', action='store_true', help=f'sizes {QUICK_SIZES}, repeat 3')
+    p_run.add_argument('--funcs', default='', help='comma list, e.g. median_filter,metrics.ssim')
+    p_run.add_argument('--warmup', type=int, default=1)
+    p_run.add_argument('--repeat', type=int, default=5)
+    p_run.add_argument('--no-data', action='store_true', help='skip the data/ images')
+    p_run.add_argument('--include-slow', action='store_true', help='run from-scratch convolutions at every size')
+    p_run.add_argument('--threads', type=int, default=None, help='cv2.setNumThreads for reproducibility')
+    p_run.add_argument('--baseline', default=None, help='compare against this JSON after the run')
+    p_run.add_argument('--threshold', type=float, default=0.10)
+    p_cmp = sub.add_parser('compare')
+    p_cmp.add_argument('baseline')
+    p_cmp.add_argument('current')
+    p_cmp.add_argument('--threshold', type=float, default=0.10)
+    p_cmp.add_argument('--verbose', action='store_true')
+    p_start = sub.add_parser('startup')
+    p_start.add_argument('--runs', type=int, default=5)
+    p_start.add_argument('--budget-ms', type=float, default=None, help='fail if the median exceeds this')
+    p_start.add_argument('--baseline', default=None, help='startup JSON to compare against')
+    p_start.add_argument('--threshold', type=float, default=0.10)
+    p_start.add_argument('--out', default=None)
+    p_start.add_argument('--onscreen', action='store_true', help='use the real display instead of offscreen Qt')
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'startup':
+        result = measure_startup(args.runs, offscreen=not args.onscreen)
+        print(f"median {result['median_ms']:.1f} ms (min {result['min_ms']:.1f}, max {result['max_ms']:.1f})")
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(result, f, indent=2)
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        problems = check_startup(result, args.budget_ms, baseline, args.threshold)
+        for p in problems:
+            print(f'FAIL: {p}')
+        return 1 if problems else 0
+
+    if args.cmd == 'run':
+        if args.threads is not None:
+            cv2.setNumThreads(args.threads)
+        sizes = QUICK_SIZES if args.quick else [s for s in args.sizes.split(',') if s]
+        for s in sizes:
+            if s not in SIZES:
+                parser.error(f'unknown size {s!r}; expected one of {list(SIZES)}')
+        repeat = 3 if args.quick else args.repeat
+        funcs = {f for f in args.funcs.split(',') if f}
+        result = run(sizes, funcs, args.warmup, repeat, not args.no_data, args.include_slow)
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"wrote {len(result['results'])} cases to {args.out}")
+        if args.baseline:
+            with open(args.baseline) as f:
+                report = compare(json.load(f), result, args.threshold)
+            print_comparison(report)
+            return 1 if report['regressions'] else 0
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    report = compare(baseline, current, args.threshold)
+    print_comparison(report, args.verbose)
+    return 1 if report['regressions'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
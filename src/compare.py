@@ -0,0 +1,90 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from . import operations as O
+from . import metrics as M
+from . import profiling as P
+
+# "Compare all": run every operation (or a subset) on the same image and lay
+# the results out as a contact sheet. All runs share one SharedIntermediates,
+# so the gray image, the Gaussian blur (Gaussian Blur + Unsharp) and the 3x3
+# gradient images are computed once for the whole sheet. Per-cell time is the
+# operation's own wall time; whichever cell first needs a shared intermediate
+# pays for it.
+#
+# PSNR/SSIM are computed at full resolution through metrics, so they are the
+# values metrics.psnr/metrics.ssim report; the original's local SSIM
+# statistics are shared, so every cell only filters its own output. Their
+# cost is reported separately as metric_ms.
+
+BG = (15, 23, 42)
+FG = (226, 232, 240)
+ACCENT = (99, 102, 241)
+
+def compare_operations(img_rgb: np.ndarray, ops=None, k: int=5, sigma: float=1.0, t1: int=100, t2: int=200,
+                       blur_mode: str='exact', workers: int=None, with_metrics: bool=True) -> dict:
+    ops = list(ops) if ops else list(O.OPERATIONS)
+    for op in ops:
+        if op not in O.OPERATIONS:
+            raise ValueError(f"Unknown operation: {op}")
+    shared = O.SharedIntermediates(img_rgb, k, sigma, blur_mode)
+
+    def run(op):
+        t0 = time.perf_counter()
+        out = O.dispatch(op, img_rgb, k, sigma, t1, t2, blur_mode, shared=shared)
+        cell = {'op': op, 'image': out, 'time_ms': (time.perf_counter() - t0) * 1000.0}
+        if with_metrics:
+            tm = time.perf_counter()
+            ref_stats = shared.get('ssim_stats', lambda: M.ssim_stats(img_rgb))
+            cell['psnr'] = M.psnr(img_rgb, out)
+            cell['ssim'] = M.ssim(img_rgb, out, multichannel=out.ndim == 3, ref_stats=ref_stats)
+            cell['metric_ms'] = (time.perf_counter() - tm) * 1000.0
+        return cell
+
+    workers = workers or min(len(ops), os.cpu_count() or 4)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        cells = list(ex.map(P.propagate(run), ops))
+    return {'cells': cells, 'total_ms': (time.perf_counter() - t0) * 1000.0}
+
+def _thumbnail(img: np.ndarray, size: int) -> np.ndarray:
+    h, w = img.shape[:2]
+    scale = size / max(h, w)
+    tw, th = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+    small = cv2.resize(img, (tw, th), interpolation=cv2.INTER_AREA)
+    if small.ndim == 2:
+        small = cv2.cvtColor(small, cv2.COLOR_GRAY2RGB)
+    canvas = np.full((size, size, 3), BG, dtype=np.uint8)
+    y0, x0 = (size - th) // 2, (size - tw) // 2
+    canvas[y0:y0+th, x0:x0+tw] = small
+    return canvas
+
+def _caption(cell: dict) -> str:
+    parts = [f"{cell['time_ms']:.1f} ms"]
+    if 'metric_ms' in cell:
+        parts[0] += f" (+{cell['metric_ms']:.0f} metrics)"
+    if 'psnr' in cell:
+        psnr = cell['psnr']
+        parts.append('inf dB' if np.isinf(psnr) else f"{psnr:.1f} dB")
+        parts.append(f"SSIM {cell['ssim']:.3f}")
+    return ' | '.join(parts)
+
+def render_contact_sheet(result: dict, original: np.ndarray=None, thumb: int=256, cols: int=4,
+                         pad: int=8, caption_h: int=40) -> np.ndarray:
+    cells = list(result['cells'])
+    if original is not None:
+        cells.insert(0, {'op': 'Original', 'image': original, 'time_ms': 0.0})
+    rows = (len(cells) + cols - 1) // cols
+    cell_w, cell_h = thumb + pad, thumb + caption_h + pad
+    sheet = np.full((rows * cell_h + pad, cols * cell_w + pad, 3), BG, dtype=np.uint8)
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    for i, cell in enumerate(cells):
+        r, c = divmod(i, cols)
+        x, y = pad + c * cell_w, pad + r * cell_h
+        sheet[y:y+thumb, x:x+thumb] = _thumbnail(cell['image'], thumb)
+        cv2.putText(sheet, cell['op'], (x + 2, y + thumb + 16), font, 0.45, FG, 1, cv2.LINE_AA)
+        if cell['op'] != 'Original':
+            cv2.putText(sheet, _caption(cell), (x + 2, y + thumb + 33), font, 0.38, ACCENT, 1, cv2.LINE_AA)
+    return sheet
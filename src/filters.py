@@ -1,26 +1,152 @@
 
+import functools
 import numpy as np
 import cv2
 from typing import Tuple
-from .utils import to_uint8, pad_to_odd
+from .utils import to_uint8, pad_to_odd, roi_aware
+
+# ---------- Halo (kernel radius) for roi= processing ----------
+def ksize_halo(a):
+    return pad_to_odd(a['ksize']) // 2
+
+def gaussian_halo(a):
+    if a.get('mode', 'exact') == 'pyramid' or 'ksize' not in a:
+        s = a['sigma'] if a['sigma'] > 0 else ksize_to_sigma(a['ksize'])
+        return int(np.ceil(4 * s))
+    return pad_to_odd(a['ksize']) // 2
+
+def bilateral_halo(a):
+    return a['d'] // 2 if a['d'] > 0 else int(round(a['sigmaSpace'] * 1.5))
 
 # ---------- Linear/Nonlinear blurs ----------
+@roi_aware(ksize_halo)
 def mean_filter(img, ksize: int=3):
     k = pad_to_odd(ksize)
     return cv2.blur(img, (k, k))
 
-def gaussian_filter(img, ksize: int=3, sigma: float=1.0):
+@roi_aware(gaussian_halo)
+def gaussian_filter(img, ksize: int=3, sigma: float=1.0, mode: str='exact', tol: float=0.01):
+    if mode not in ('exact', 'pyramid'):
+        raise ValueError(f"Unknown gaussian mode: {mode}")
     k = pad_to_odd(ksize)
+    if mode == 'pyramid':
+        s = sigma if sigma > 0 else ksize_to_sigma(ksize)
+        # the pyramid approximates the untruncated Gaussian; a k x k kernel
+        # narrower than 6 sigma is a different filter, so run it exactly
+        if k >= 6 * s:
+            return pyramid_gaussian_filter(img, s, tol)
     return cv2.GaussianBlur(img, (k, k), sigmaX=sigma, sigmaY=sigma)
 
+# ---------- Multiscale (pyramid) Gaussian ----------
+# Each pyrDown/pyrUp step smooths with the 5-tap binomial kernel (variance 1 at
+# the finer scale), so going down L levels and back up already contributes a
+# variance of 2*(4^L - 1)/3 original pixels^2. The remainder is applied as a
+# small residual blur at the coarsest level, which keeps the cost roughly
+# constant as sigma grows.
+#
+# `tol` bounds the output error: the deepest level is picked whose worst-case
+# |pyramid - GaussianBlur|, over every possible input, stays within tol times
+# the data range (plus half a gray level of final rounding for uint8). The
+# image is reflect-101 padded first, GaussianBlur's own border rule, so the
+# borders are held to the same bound as the interior.
+PYR_KERNEL = np.array([1, 4, 6, 4, 1], dtype=np.float64) / 16.0
+
+def ksize_to_sigma(ksize: int) -> float:
+    # same rule cv2.getGaussianKernel uses when sigma <= 0
+    k = pad_to_odd(ksize)
+    return 0.3 * ((k - 1) * 0.5 - 1) + 0.8
+
+def _auto_ksize(sigma: float) -> int:
+    # kernel size cv2.GaussianBlur picks for 8-bit images when ksize=(0, 0)
+    return int(round(sigma * 6 + 1)) | 1
+
+def _residual_sigma(sigma: float, levels: int) -> float:
+    scale = 4.0 ** levels
+    var = sigma**2 / scale - 2.0 * (scale - 1.0) / (3.0 * scale)
+    return float(np.sqrt(var)) if var > 1e-6 else 0.0
+
+def _circular_filter(x: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    r = len(kernel) // 2
+    return sum(c * np.roll(x, r - i, axis=0) for i, c in enumerate(kernel))
+
+@functools.lru_cache(maxsize=512)
+def pyramid_error(sigma: float, levels: int) -> float:
+    # Worst-case |pyramid - exact| as a fraction of the data range. Both
+    # filters are separable with non-negative rows summing to 1, so the 2-D
+    # error is at most the largest L1 row difference of the 1-D operators,
+    # which are built here on a periodic signal from one impulse per phase
+    # (the pyramid repeats every 2^levels samples).
+    s = _residual_sigma(sigma, levels)
+    if levels <= 0 or s == 0.0:
+        return 0.0 if levels <= 0 else float('inf')
+    period = 2 ** levels
+    n = period * int(np.ceil((8 * sigma + 16 * period) / period))
+    x = np.zeros((n, period))
+    x[np.arange(period), np.arange(period)] = 1.0
+    for _ in range(levels):
+        x = _circular_filter(x, PYR_KERNEL)[::2]
+    x = _circular_filter(x, cv2.getGaussianKernel(_auto_ksize(s), s).ravel())
+    for _ in range(levels):
+        up = np.zeros((2 * x.shape[0], period))
+        up[::2] = x
+        x = _circular_filter(up, 2 * PYR_KERNEL)
+    g = cv2.getGaussianKernel(_auto_ksize(sigma), sigma).ravel()
+    ref = np.zeros(n)
+    ref[(np.arange(len(g)) - len(g) // 2) % n] = g
+    # row r of the pyramid operator: A[r, j] = x[(r - j + j % period) % n, j % period]
+    r, j = np.arange(period)[:, None], np.arange(n)
+    rows = x[(r - j + j % period) % n, j % period]
+    return float(np.abs(rows - ref[(j - r) % n]).sum(axis=1).max())
+
+def pyramid_levels(sigma: float, tol: float=0.01, shape: Tuple[int, int]=None, min_size: int=16) -> int:
+    # deepest level whose pyramid_error() stays within tol; 0 means "run exactly"
+    if sigma <= 0 or tol <= 0:
+        return 0
+    sigma = round(float(sigma), 3)
+    levels, best = 1, 0
+    while _residual_sigma(sigma, levels) > 0.0:
+        if shape is not None and min(shape[:2]) >> levels < min_size:
+            break
+        if pyramid_error(sigma, levels) <= tol:
+            best = levels
+        levels += 1
+    return best
+
+@roi_aware(gaussian_halo)
+def pyramid_gaussian_filter(img, sigma: float, tol: float=0.01):
+    levels = pyramid_levels(sigma, tol, img.shape)
+    if levels == 0:
+        return cv2.GaussianBlur(img, (0, 0), sigmaX=sigma, sigmaY=sigma)
+    period = 2 ** levels
+    h, w = img.shape[:2]
+    # margin covers the Gaussian's support plus the pyramid's own edge
+    # effects, rounded up so every level halves the size exactly
+    m = int(np.ceil(4 * sigma)) + 4 * period
+    bottom, right = m + (-(h + 2 * m)) % period, m + (-(w + 2 * m)) % period
+    cur = cv2.copyMakeBorder(img, m, bottom, m, right, cv2.BORDER_REFLECT_101).astype(np.float32)
+    for _ in range(levels):
+        cur = cv2.pyrDown(cur)
+    s = _residual_sigma(sigma, levels)
+    k = _auto_ksize(s)
+    cur = cv2.GaussianBlur(cur, (k, k), sigmaX=s, sigmaY=s)
+    for _ in range(levels):
+        cur = cv2.pyrUp(cur)
+    out = cur[m:m+h, m:m+w]
+    if img.dtype == np.uint8:
+        return np.clip(np.rint(out), 0, 255).astype(np.uint8)
+    return out.astype(img.dtype)
+
+@roi_aware(ksize_halo)
 def median_filter(img, ksize: int=3):
     k = pad_to_odd(ksize)
     return cv2.medianBlur(img, k)
 
+@roi_aware(bilateral_halo)
 def bilateral_filter(img, d: int=9, sigmaColor: float=75, sigmaSpace: float=75):
     return cv2.bilateralFilter(img, d, sigmaColor, sigmaSpace)
 
 # ---------- Convolution from scratch (grayscale) ----------
+@roi_aware(lambda a: max(a['kernel'].shape) // 2)
 def convolve2d(img_gray: np.ndarray, kernel: np.ndarray) -> np.ndarray:
     kh, kw = kernel.shape
     pad_y, pad_x = kh // 2, kw // 2
@@ -34,6 +160,28 @@ def convolve2d(img_gray: np.ndarray, kernel: np.ndarray) -> np.ndarray:
     out = np.clip(out, 0, 255)
     return out.astype(np.uint8)
 
+# ---------- Convolution, vectorized (same output as convolve2d) ----------
+# Accumulates one shifted slice of the padded image per kernel tap instead of
+# one Python iteration per pixel. `padded` lets callers reuse the padding
+# across several kernels of the same size.
+def reflect_pad(img_gray: np.ndarray, kh: int, kw: int) -> np.ndarray:
+    return np.pad(img_gray, ((kh // 2, kh // 2), (kw // 2, kw // 2)), mode='reflect').astype(np.float32)
+
+@roi_aware(lambda a: max(a['kernel'].shape) // 2)
+def convolve2d_fast(img_gray: np.ndarray, kernel: np.ndarray, padded: np.ndarray=None) -> np.ndarray:
+    kh, kw = kernel.shape
+    if padded is None:
+        padded = reflect_pad(img_gray, kh, kw)
+    h, w = img_gray.shape[:2]
+    kernel_flipped = np.flipud(np.fliplr(kernel)).astype(np.float32)
+    out = np.zeros((h, w), dtype=np.float32)
+    for dy in range(kh):
+        for dx in range(kw):
+            if kernel_flipped[dy, dx] != 0:
+                out += kernel_flipped[dy, dx] * padded[dy:dy+h, dx:dx+w]
+    out = np.clip(out, 0, 255)
+    return out.astype(np.uint8)
+
 # ---------- Edge detectors ----------
 def sobel_kernels():
     gx = np.array([[-1, 0, 1],
@@ -58,25 +206,31 @@ def laplacian_kernel():
                      [1,-4, 1],
                      [0, 1, 0]], dtype=np.float32)
 
+def gradient_magnitude(ix: np.ndarray, iy: np.ndarray) -> np.ndarray:
+    mag = np.sqrt(ix.astype(np.float32)**2 + iy.astype(np.float32)**2)
+    return (mag / mag.max() * 255.0).astype(np.uint8)
+
+# with roi= the Sobel/Prewitt magnitude is scaled by the ROI's own maximum
+# (local normalization), so it can differ from the same pixels of a full-frame run
+@roi_aware(1)
 def sobel(img_gray):
     gx, gy = sobel_kernels()
     ix = convolve2d(img_gray, gx)
     iy = convolve2d(img_gray, gy)
-    mag = np.sqrt(ix.astype(np.float32)**2 + iy.astype(np.float32)**2)
-    mag = (mag / mag.max() * 255.0).astype(np.uint8)
-    return ix, iy, mag
+    return ix, iy, gradient_magnitude(ix, iy)
 
+@roi_aware(1)
 def prewitt(img_gray):
     gx, gy = prewitt_kernels()
     ix = convolve2d(img_gray, gx)
     iy = convolve2d(img_gray, gy)
-    mag = np.sqrt(ix.astype(np.float32)**2 + iy.astype(np.float32)**2)
-    mag = (mag / mag.max() * 255.0).astype(np.uint8)
-    return ix, iy, mag
+    return ix, iy, gradient_magnitude(ix, iy)
 
+@roi_aware(1)
 def laplacian(img_gray):
     k = laplacian_kernel()
     return convolve2d(img_gray, k)
 
+@roi_aware(3)
 def canny(img_gray, low_thresh: int=100, high_thresh: int=200):
     return cv2.Canny(img_gray, low_thresh, high_thresh)
@@ -1,10 +1,24 @@
-
 import numpy as np
 import math
-try:
-    from skimage.metrics import structural_similarity as ssim_fn
-except Exception:
-    ssim_fn = None
+import cv2
+
+# scikit-image is imported on the first SSIM call, not at module import
+_ssim_fn = None
+_ssim_loaded = False
+
+def get_ssim_fn():
+    global _ssim_fn, _ssim_loaded
+    if not _ssim_loaded:
+        try:
+            from skimage.metrics import structural_similarity as ssim_fn
+        except Exception:
+            ssim_fn = None
+        _ssim_fn, _ssim_loaded = ssim_fn, True
+    return _ssim_fn
+
+# skimage's default SSIM window and constants, for ssim(..., ref_stats=)
+SSIM_WIN = 7
+SSIM_C1, SSIM_C2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
 
 def mse(img1, img2):
     return np.mean((img1.astype(np.float32) - img2.astype(np.float32))**2)
@@ -15,7 +29,51 @@ def psnr(img1, img2, max_pixel: float=255.0) -> float:
         return float('inf')
     return 20 * math.log10(max_pixel) - 10 * math.log10(m)
 
-def ssim(img1, img2, multichannel: bool=True):
+def ssim_stats(img):
+    # local statistics of a reference image; pass them as
+    # ssim(ref, other, ref_stats=...) to compare one reference with many images
+    x = img.astype(np.float64)
+    mu = cv2.blur(x, (SSIM_WIN, SSIM_WIN))
+    mu2 = mu * mu
+    var = cv2.sqrBoxFilter(x, cv2.CV_64F, (SSIM_WIN, SSIM_WIN)) - mu2
+    mu2 += SSIM_C1
+    n = SSIM_WIN * SSIM_WIN
+    var *= n / (n - 1.0)
+    return x, mu, mu2, var
+
+def _ssim_from_stats(ref_stats, img2) -> float:
+    # same as skimage's default (uniform window, sample covariance, borders
+    # cropped); with several channels, the mean over channels. Computed in
+    # place, since every temporary is a full-resolution float image.
+    x, mx, mx2_c1, vx = ref_stats
+    y = img2.astype(np.float64)
+    win = (SSIM_WIN, SSIM_WIN)
+    n = SSIM_WIN * SSIM_WIN
+    c = n / (n - 1.0)
+    my = cv2.blur(y, win)
+    mxy = mx * my
+    cov = cv2.blur(np.multiply(x, y, out=y), win)
+    cov -= mxy
+    cov *= 2 * c
+    cov += SSIM_C2                                  # 2 cov + C2
+    mxy *= 2
+    mxy += SSIM_C1                                  # 2 mx my + C1
+    num = np.multiply(mxy, cov, out=mxy)
+    my2 = np.multiply(my, my, out=my)
+    var = cv2.sqrBoxFilter(img2, cv2.CV_64F, win)
+    var -= my2
+    var *= c
+    var += vx
+    var += SSIM_C2                                  # vx + vy + C2
+    my2 += mx2_c1                                   # mx^2 + my^2 + C1
+    den = np.multiply(my2, var, out=my2)
+    r = SSIM_WIN // 2
+    return float((num[r:-r, r:-r] / den[r:-r, r:-r]).mean())
+
+def ssim(img1, img2, multichannel: bool=True, ref_stats=None):
+    if ref_stats is not None:
+        return _ssim_from_stats(ref_stats, img2)
+    ssim_fn = get_ssim_fn()
     if ssim_fn is None:
         # very simple fallback: return 1 - normalized MSE (not a true SSIM)
         m = mse(img1, img2)
@@ -0,0 +1,468 @@
+import json
+import os
+import platform
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from . import filters as F
+from . import enhancement as E
+from . import profiling as P
+from . import utils as U
+
+# Operation registry.
+#
+# Every entry of the editor's operation menu is declared once, with its
+# parameters, the dtypes and channel counts it accepts, whether it works on the
+# gray image, its halo (kernel radius, used for ROI and tiling) and one or more
+# interchangeable backends. The first backend is the reference.
+#
+# run_operation() asks BackendTuner for a backend. The first time an
+# (op, image size, channels, kernel size, mode) bucket is seen, every eligible
+# backend runs on a central crop of the input of at most CALIBRATION_SIDE
+# pixels a side. Calibrations are serialized process-wide, so concurrent
+# callers (compare mode, server workers) do not skew each other's timings.
+# Outputs that differ from the reference are rejected. The fastest correct
+# backend is saved to a JSON file (PHOTO_EDITOR_TUNING_FILE, default
+# ~/.cache/tieu_luan_2_xla/backends.json) and reused afterwards.
+# PHOTO_EDITOR_AUTOTUNE=0 always uses the reference.
+
+Param = namedtuple('Param', ['name', 'kind', 'default', 'low', 'high', 'choices'], defaults=(None, None, None))
+# accepts(p) -> False rules a backend out for those parameters
+Backend = namedtuple('Backend', ['fn', 'max_pixels', 'accepts'], defaults=(None, None))
+
+K = Param('k', int, 5, 1, 99)
+SIGMA = Param('sigma', float, 1.0, 0, 50)
+T1 = Param('t1', int, 100, 0, 255)
+T2 = Param('t2', int, 200, 0, 255)
+BLUR_MODE = Param('blur_mode', str, 'exact', choices=('exact', 'pyramid'))
+
+# the per-pixel Python loop is only worth running (as the reference) on small images
+LOOP_MAX_PIXELS = 256 * 256
+
+class Operation:
+    def __init__(self, name: str, params, backends: dict, halo=0, gray: bool=False, dtypes=('uint8',),
+                 channels=(1, 3), tolerance: int=0, tile: str=None, shared_fn=None, shared_backend: str=None):
+        self.name = name
+        self.params = tuple(params)
+        self.backends = dict(backends)
+        self.halo_fn = halo if callable(halo) else (lambda p, h=halo: h)
+        self.gray = gray
+        self.dtypes = tuple(dtypes)
+        self.channels = tuple(channels)
+        self.tolerance = tolerance
+        # shared_fn computes backend `shared_backend` (any backend if None)
+        # from SharedIntermediates
+        self.shared_fn = shared_fn
+        self.shared_backend = shared_backend
+        if tile is not None:
+            # pyramid blurs depend on the 2^levels grid, which strips break
+            self.backends['tiled'] = Backend(tiled(self.backends[tile].fn, self.halo),
+                                             accepts=lambda p: p.get('blur_mode') != 'pyramid')
+
+    def bind(self, **values) -> dict:
+        p = {}
+        for prm in self.params:
+            v = values.get(prm.name)
+            if v is None:
+                v = prm.default
+            elif prm.kind is int:
+                f = float(v)
+                if not f.is_integer():
+                    raise ValueError(f"{self.name}: {prm.name} must be an integer, got {v!r}")
+                v = int(f)
+            else:
+                v = prm.kind(v)
+            if prm.choices is not None and v not in prm.choices:
+                raise ValueError(f"{self.name}: {prm.name} must be one of {prm.choices}, got {v!r}")
+            if prm.low is not None and not prm.low <= v <= prm.high:
+                raise ValueError(f"{self.name}: {prm.name} must be in [{prm.low}, {prm.high}], got {v}")
+            p[prm.name] = v
+        return p
+
+    def halo(self, p: dict) -> int:
+        return int(self.halo_fn(p))
+
+    def check(self, img: np.ndarray):
+        if img.dtype.name not in self.dtypes:
+            raise ValueError(f"{self.name}: unsupported dtype {img.dtype}, expected one of {self.dtypes}")
+        ch = 1 if img.ndim == 2 else img.shape[2]
+        if ch not in self.channels:
+            raise ValueError(f"{self.name}: unsupported channel count {ch}, expected one of {self.channels}")
+
+    def prepare(self, img: np.ndarray, shared=None) -> np.ndarray:
+        if self.gray and img.ndim == 3:
+            return shared.gray() if shared is not None else cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        return img
+
+    def eligible(self, img: np.ndarray, p: dict) -> list:
+        npix = img.shape[0] * img.shape[1]
+        return [n for n, b in self.backends.items()
+                if (b.max_pixels is None or npix <= b.max_pixels) and (b.accepts is None or b.accepts(p))]
+
+    def matches(self, ref: np.ndarray, out: np.ndarray) -> bool:
+        if ref.shape != out.shape or ref.dtype != out.dtype:
+            return False
+        if self.tolerance == 0:
+            return np.array_equal(ref, out)
+        return int(np.max(np.abs(ref.astype(np.int32) - out.astype(np.int32)))) <= self.tolerance
+
+    def describe(self) -> dict:
+        defaults = {prm.name: prm.default for prm in self.params}
+        return {
+            'name': self.name,
+            'params': [{'name': prm.name, 'default': prm.default, 'low': prm.low, 'high': prm.high,
+                        'choices': list(prm.choices) if prm.choices else None} for prm in self.params],
+            'gray': self.gray, 'dtypes': list(self.dtypes), 'channels': list(self.channels),
+            'halo_at_defaults': self.halo(defaults), 'backends': list(self.backends),
+        }
+
+REGISTRY = {}
+
+def register(op: Operation) -> Operation:
+    REGISTRY[op.name] = op
+    return op
+
+def get_operation(name: str) -> Operation:
+    op = REGISTRY.get(name)
+    if op is None:
+        raise ValueError(f"Unknown operation: {name!r}. Expected one of {list(REGISTRY)}")
+    return op
+
+# ---------- Tiled backend ----------
+_tile_pool = None
+_tile_lock = threading.Lock()
+
+def _tile_executor() -> ThreadPoolExecutor:
+    global _tile_pool
+    with _tile_lock:
+        if _tile_pool is None:
+            _tile_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix='tile')
+    return _tile_pool
+
+def tiled(fn, halo):
+    # Horizontal strips with `halo` rows of context, run in a thread pool
+    # (OpenCV releases the GIL); same output as fn on the whole image.
+    def run(img, p):
+        h = img.shape[0]
+        r = halo(p)
+        n = min(os.cpu_count() or 4, max(1, h // max(64, 4 * r)))
+        if n == 1:
+            return fn(img, p)
+        bounds = np.linspace(0, h, n + 1).astype(int)
+
+        def strip(i):
+            y0, y1 = int(bounds[i]), int(bounds[i + 1])
+            oy0, oy1 = max(0, y0 - r), min(h, y1 + r)
+            return fn(img[oy0:oy1], p)[y0 - oy0:y1 - oy0]
+        return np.concatenate(list(_tile_executor().map(P.propagate(strip), range(n))), axis=0)
+    return run
+
+# ---------- Backend tuning ----------
+SIZE_BUCKETS = [('256', 256 * 256), ('512', 512 * 512), ('1K', 1024 * 1024), ('2K', 2048 * 2048),
+                ('4K', 3840 * 2160), ('8K', 7680 * 4320)]
+KERNEL_BUCKETS = [3, 7, 15, 31]
+CALIBRATION_SIDE = 1024
+
+def calibration_input(img: np.ndarray) -> np.ndarray:
+    # central crop, so calibrating a huge image stays a micro-benchmark
+    h, w = img.shape[:2]
+    ch, cw = min(h, CALIBRATION_SIDE), min(w, CALIBRATION_SIDE)
+    y0, x0 = (h - ch) // 2, (w - cw) // 2
+    return np.ascontiguousarray(img[y0:y0+ch, x0:x0+cw])
+
+def bucket_key(op: Operation, img: np.ndarray, p: dict) -> str:
+    npix = img.shape[0] * img.shape[1]
+    size = next((label for label, limit in SIZE_BUCKETS if npix <= limit), '8K+')
+    ch = 1 if img.ndim == 2 else img.shape[2]
+    if 'k' in p:
+        kb = next((f'k<={b}' for b in KERNEL_BUCKETS if p['k'] <= b), f'k>{KERNEL_BUCKETS[-1]}')
+    else:
+        kb = '-'
+    return '|'.join([op.name, size, f'{ch}ch', kb, p.get('blur_mode', '-')])
+
+def fingerprint() -> dict:
+    # timings from another machine or library build are not reused
+    return {'machine': platform.machine(), 'cpu_count': os.cpu_count(), 'opencv': cv2.__version__,
+            'numpy': np.__version__, 'opencv_threads': cv2.getNumThreads()}
+
+class BackendTuner:
+    def __init__(self, path: str=None, enabled: bool=True):
+        self.path = path
+        self.enabled = enabled
+        self._table = None
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._calibration_lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if self._table is None:
+            table = {}
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path) as f:
+                        data = json.load(f)
+                    if data.get('fingerprint') == fingerprint():
+                        table = data.get('choices', {})
+                except (OSError, ValueError):
+                    pass
+            self._table = table
+        return self._table
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'fingerprint': fingerprint(), 'choices': self._table}, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except OSError:
+            # a read-only cache dir only costs a re-calibration next session
+            pass
+
+    def choices(self) -> dict:
+        with self._lock:
+            return dict(self._load())
+
+    def choose(self, op: Operation, img: np.ndarray, p: dict):
+        # -> (backend name, output if calibration already produced it, else None)
+        eligible = op.eligible(img, p)
+        if len(eligible) == 1 or not self.enabled:
+            return eligible[0], None
+        key = bucket_key(op, img, p)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._load().get(key)
+            if entry and entry['backend'] in eligible:
+                return entry['backend'], None
+            sample = calibration_input(img)
+            with self._calibration_lock:
+                name, out, entry = self.calibrate(op, sample, p, eligible)
+            entry['calibrated_on'] = list(sample.shape)
+            with self._lock:
+                self._load()[key] = entry
+                self._save()
+            # the calibration output is only reusable if it covers the whole input
+            return name, out if sample.shape == img.shape else None
+
+    def calibrate(self, op: Operation, img: np.ndarray, p: dict, eligible: list):
+        ref, best, best_out = None, None, None
+        times, rejected = {}, []
+        for name in eligible:
+            fn = op.backends[name].fn
+            t_min = float('inf')
+            for _ in range(3):
+                t0 = time.perf_counter()
+                out = fn(img, p)
+                dt = time.perf_counter() - t0
+                t_min = min(t_min, dt)
+                if dt > 0.05:
+                    # long enough that one run is representative
+                    break
+            if ref is None:
+                ref = out
+            elif not op.matches(ref, out):
+                rejected.append(name)
+                continue
+            times[name] = t_min * 1000.0
+            if best is None or times[name] < times[best]:
+                best, best_out = name, out
+        entry = {'backend': best, 'times_ms': {n: round(t, 3) for n, t in times.items()}, 'rejected': rejected}
+        return best, best_out, entry
+
+def _default_tuning_file() -> str:
+    return os.environ.get('PHOTO_EDITOR_TUNING_FILE',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'tieu_luan_2_xla', 'backends.json'))
+
+TUNER = BackendTuner(_default_tuning_file(), enabled=os.environ.get('PHOTO_EDITOR_AUTOTUNE', '1') != '0')
+
+class SharedIntermediates:
+    # Lazily computed, thread-safe cache of intermediates several operations
+    # need for the same input and parameters (gray image, Gaussian blur,
+    # padded gray for the 3x3 gradient kernels, gradient images). Concurrent
+    # callers asking for the same key wait for a single computation.
+    def __init__(self, img_rgb: np.ndarray, k: int=5, sigma: float=1.0, blur_mode: str='exact'):
+        self.img_rgb = img_rgb
+        self.k = k
+        self.sigma = sigma
+        self.blur_mode = blur_mode
+        self._values = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def get(self, key, compute):
+        with self._guard:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._values:
+                self._values[key] = compute()
+            return self._values[key]
+
+    def gray(self) -> np.ndarray:
+        return self.get('gray', lambda: cv2.cvtColor(self.img_rgb, cv2.COLOR_RGB2GRAY))
+
+    def blur(self) -> np.ndarray:
+        # tuned like a standalone Gaussian Blur (all its backends agree exactly)
+        return self.get('blur', lambda: run_operation('Gaussian Blur', self.img_rgb, self.k, self.sigma,
+                                                      blur_mode=self.blur_mode, as_rgb=False))
+
+    def padded3(self) -> np.ndarray:
+        return self.get('padded3', lambda: F.reflect_pad(self.gray(), 3, 3))
+
+    def conv3(self, name: str, kernel: np.ndarray) -> np.ndarray:
+        return self.get(('conv3', name), lambda: F.convolve2d_fast(self.gray(), kernel, padded=self.padded3()))
+
+    def sobel(self):
+        gx, gy = F.sobel_kernels()
+        ix, iy = self.conv3('sobel_x', gx), self.conv3('sobel_y', gy)
+        return ix, iy, self.get('sobel_mag', lambda: F.gradient_magnitude(ix, iy))
+
+    def prewitt(self):
+        gx, gy = F.prewitt_kernels()
+        ix, iy = self.conv3('prewitt_x', gx), self.conv3('prewitt_y', gy)
+        return ix, iy, self.get('prewitt_mag', lambda: F.gradient_magnitude(ix, iy))
+
+
+# ---------- Backends ----------
+def conv_opencv(img_gray: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    # same output as F.convolve2d: filter2D correlates, so the kernel is
+    # flipped; np.pad 'reflect' is OpenCV's BORDER_REFLECT_101
+    out = cv2.filter2D(img_gray, cv2.CV_32F, np.ascontiguousarray(kernel[::-1, ::-1]),
+                       borderType=cv2.BORDER_REFLECT_101)
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+def gradient_backends(name: str) -> dict:
+    # looked up on the module at call time so profiling sees the calls
+    kernels = lambda: getattr(F, f'{name}_kernels')()
+
+    def numpy_fast(img, p):
+        gx, gy = kernels()
+        padded = F.reflect_pad(img, 3, 3)
+        return F.gradient_magnitude(F.convolve2d_fast(img, gx, padded=padded),
+                                    F.convolve2d_fast(img, gy, padded=padded))
+
+    def opencv(img, p):
+        gx, gy = kernels()
+        return F.gradient_magnitude(conv_opencv(img, gx), conv_opencv(img, gy))
+    return {
+        'numpy-loop': Backend(lambda img, p: getattr(F, name)(img)[2], LOOP_MAX_PIXELS),
+        'numpy': Backend(numpy_fast),
+        'opencv': Backend(opencv),
+    }
+
+def ksize_halo(p):
+    return U.pad_to_odd(p['k']) // 2
+
+def gaussian_halo(p):
+    return F.gaussian_halo({'ksize': p['k'], 'sigma': p['sigma'], 'mode': p['blur_mode']})
+
+def unsharp(img, p, blurred=None):
+    return E.unsharp_mask(img, p['k'], p['sigma'], amount=1.5, threshold=0, mode=p['blur_mode'], blurred=blurred)
+
+register(Operation('Mean Blur', [K], {
+    'opencv': Backend(lambda img, p: F.mean_filter(img, p['k'])),
+}, halo=ksize_halo, tile='opencv'))
+
+register(Operation('Gaussian Blur', [K, SIGMA, BLUR_MODE], {
+    'opencv': Backend(lambda img, p: F.gaussian_filter(img, p['k'], p['sigma'], mode=p['blur_mode'])),
+}, halo=gaussian_halo, tile='opencv', shared_fn=lambda img, p, s: s.blur()))
+
+register(Operation('Median Blur', [K], {
+    'opencv': Backend(lambda img, p: F.median_filter(img, p['k'])),
+}, halo=ksize_halo, tile='opencv'))
+
+register(Operation('Bilateral', [K], {
+    'opencv': Backend(lambda img, p: F.bilateral_filter(img, d=max(3, p['k']), sigmaColor=75, sigmaSpace=75)),
+}, halo=lambda p: max(3, p['k']) // 2, tile='opencv'))
+
+register(Operation('Sharpen (Unsharp)', [K, SIGMA, BLUR_MODE], {
+    'opencv': Backend(unsharp),
+}, halo=gaussian_halo, tile='opencv', shared_fn=lambda img, p, s: unsharp(img, p, blurred=s.blur())))
+
+register(Operation('Sharpen (Laplacian)', [], {
+    'opencv': Backend(lambda img, p: E.laplacian_sharpen(img)),
+}, halo=1, gray=True, tile='opencv'))
+
+# Sobel/Prewitt normalize by the global maximum, so they are not tiled; with
+# roi= that maximum is the ROI's (see filters.sobel)
+register(Operation('Edge: Sobel', [], gradient_backends('sobel'),
+                   halo=1, gray=True, shared_fn=lambda img, p, s: s.sobel()[2], shared_backend='numpy'))
+
+register(Operation('Edge: Prewitt', [], gradient_backends('prewitt'),
+                   halo=1, gray=True, shared_fn=lambda img, p, s: s.prewitt()[2], shared_backend='numpy'))
+
+register(Operation('Edge: Laplacian', [], {
+    'numpy-loop': Backend(lambda img, p: F.laplacian(img), LOOP_MAX_PIXELS),
+    'numpy': Backend(lambda img, p: F.convolve2d_fast(img, F.laplacian_kernel())),
+    'opencv': Backend(lambda img, p: conv_opencv(img, F.laplacian_kernel())),
+}, halo=1, gray=True, tile='numpy',
+   shared_fn=lambda img, p, s: s.conv3('laplacian', F.laplacian_kernel()), shared_backend='numpy'))
+
+register(Operation('Edge: Canny', [T1, T2], {
+    'opencv': Backend(lambda img, p: F.canny(img, p['t1'], p['t2'])),
+}, halo=3, gray=True))
+
+register(Operation('HistEq (global)', [], {
+    'opencv': Backend(lambda img, p: E.hist_equalization(img)),
+}, gray=True))
+
+register(Operation('CLAHE', [], {
+    'opencv': Backend(lambda img, p: E.clahe_equalization(img, clip_limit=2.0, tile_grid_size=(8,8))),
+}, gray=True))
+
+# Same entries as the editor's operation menu (without the emoji prefix)
+OPERATIONS = list(REGISTRY)
+
+def describe_operations() -> list:
+    return [op.describe() for op in REGISTRY.values()]
+
+# ---------- Entry points ----------
+def run_operation(op: str, img_rgb: np.ndarray, k: int=5, sigma: float=1.0, t1: int=100, t2: int=200,
+                  blur_mode: str='exact', roi=None, backend: str=None, as_rgb: bool=True,
+                  shared: SharedIntermediates=None) -> np.ndarray:
+    # `backend` forces one implementation instead of the tuned choice;
+    # as_rgb=False returns gray ops' output as a single channel.
+    spec = get_operation(op)
+    p = spec.bind(k=k, sigma=sigma, t1=t1, t2=t2, blur_mode=blur_mode)
+    spec.check(img_rgb)
+    if backend is not None and backend not in spec.backends:
+        raise ValueError(f"{spec.name}: unknown backend {backend!r}, expected one of {list(spec.backends)}")
+    accepts = backend is not None and spec.backends[backend].accepts
+    if accepts and not accepts(p):
+        raise ValueError(f"{spec.name}: backend {backend!r} does not support these parameters")
+    if roi is not None:
+        # the ROI is pasted back into the input, so keep its channel layout
+        keep_rgb = img_rgb.ndim == 3
+        return U.run_on_roi(lambda patch: execute(spec, patch, p, backend, as_rgb=keep_rgb),
+                            img_rgb, roi, spec.halo(p))
+    return execute(spec, img_rgb, p, backend, as_rgb=as_rgb, shared=shared)
+
+def execute(spec: Operation, img: np.ndarray, p: dict, backend: str=None, as_rgb: bool=True,
+            shared: SharedIntermediates=None) -> np.ndarray:
+    x = spec.prepare(img, shared)
+    use_shared = shared is not None and spec.shared_fn is not None
+    out = None
+    if use_shared and spec.shared_backend is None:
+        # the intermediate is tuned where it is computed (SharedIntermediates.blur)
+        out = spec.shared_fn(x, p, shared)
+    else:
+        if backend is None:
+            backend, out = TUNER.choose(spec, x, p)
+        if out is None and use_shared and backend == spec.shared_backend:
+            out = spec.shared_fn(x, p, shared)
+        elif out is None:
+            out = spec.backends[backend].fn(x, p)
+    if as_rgb and out.ndim == 2:
+        out = cv2.cvtColor(out, cv2.COLOR_GRAY2RGB)
+    return out
+
+def dispatch(op: str, img_rgb: np.ndarray, k: int, sigma: float, t1: int, t2: int,
+             blur_mode: str='exact', shared: SharedIntermediates=None) -> np.ndarray:
+    # `shared` must have been built for the same img_rgb, k, sigma and blur_mode
+    return run_operation(op, img_rgb, k, sigma, t1, t2, blur_mode=blur_mode, shared=shared)
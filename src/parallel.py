@@ -0,0 +1,228 @@
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+from . import utils as U
+
+# Process-parallel filtering without pickling pixels.
+#
+# Input and output arrays live in multiprocessing.shared_memory blocks; only a
+# small descriptor (name, shape, dtype, offset) crosses the process boundary.
+# Workers attach to the block once and build ndarray views on it. OpenCV
+# functions (cv2.GaussianBlur, ...) get the output view as dst= and write
+# straight into the block; other callables return a new array, which is
+# copied in, as are strips computed with a halo. Blocks are recycled through
+# a pool keyed by power-of-two capacity, so the executor itself allocates
+# nothing in steady state.
+#
+#   with SharedMemoryExecutor(workers=8) as ex:
+#       out = ex.run_tiled(F.median_filter, img, 9)     # one image, split in strips
+#       ...
+#       ex.release(out)                                 # hand the block back
+#
+# Only use run_tiled with local (kernel) operations: global ones such as
+# histogram equalization would see each strip's statistics only.
+
+ArrayDesc = namedtuple('ArrayDesc', ['name', 'shape', 'dtype', 'offset'])
+
+MIN_BLOCK = 1 << 16
+
+class BlockPool:
+    def __init__(self):
+        self._free = {}
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def capacity(nbytes: int) -> int:
+        return max(MIN_BLOCK, 1 << max(0, int(nbytes) - 1).bit_length())
+
+    def acquire(self, nbytes: int) -> shared_memory.SharedMemory:
+        cap = self.capacity(nbytes)
+        with self._lock:
+            free = self._free.get(cap)
+            if free:
+                return free.pop()
+        shm = shared_memory.SharedMemory(create=True, size=cap)
+        with self._lock:
+            self._blocks[shm.name] = shm
+        return shm
+
+    def release(self, shm: shared_memory.SharedMemory):
+        with self._lock:
+            self._free.setdefault(self.capacity(shm.size), []).append(shm)
+
+    def find(self, addr: int):
+        # block containing this address, with the offset into it
+        with self._lock:
+            for shm in self._blocks.values():
+                base = np.frombuffer(shm.buf, dtype=np.uint8).ctypes.data
+                if base <= addr < base + shm.size:
+                    return shm, addr - base
+        return None, 0
+
+    def close(self):
+        with self._lock:
+            blocks, self._blocks, self._free = list(self._blocks.values()), {}, {}
+        for shm in blocks:
+            try:
+                shm.close()
+            except BufferError:
+                # arrays from empty() still alive; the mapping goes with them
+                pass
+            shm.unlink()
+
+# ---------- Worker side ----------
+# Pool workers share the parent's resource tracker, so attaching does not
+# cause the block to be unlinked when a worker exits; the parent unlinks.
+_attached = {}
+
+def _view(desc: ArrayDesc) -> np.ndarray:
+    shm = _attached.get(desc.name)
+    if shm is None:
+        shm = shared_memory.SharedMemory(name=desc.name)
+        _attached[desc.name] = shm
+    return np.ndarray(desc.shape, dtype=np.dtype(desc.dtype), buffer=shm.buf, offset=desc.offset)
+
+def _writes_dst(fn) -> bool:
+    return getattr(cv2, getattr(fn, '__name__', ''), None) is fn
+
+def _apply(fn, src: np.ndarray, dst: np.ndarray, args, kwargs):
+    if _writes_dst(fn):
+        # OpenCV only reallocates when dst has the wrong shape or dtype
+        res = fn(src, *args, dst=dst, **kwargs)
+        if res is dst:
+            return
+    else:
+        res = fn(src, *args, **kwargs)
+    dst[...] = res
+
+def _run_task(fn, src_desc: ArrayDesc, dst_desc: ArrayDesc, rows, halo: int, args, kwargs):
+    src = _view(src_desc)
+    dst = _view(dst_desc)
+    if rows is None:
+        _apply(fn, src, dst, args, kwargs)
+        return None
+    y0, y1 = rows
+    oy0, oy1 = max(0, y0 - halo), min(src.shape[0], y1 + halo)
+    if (oy0, oy1) == (y0, y1):
+        _apply(fn, src[y0:y1], dst[y0:y1], args, kwargs)
+    else:
+        res = fn(src[oy0:oy1], *args, **kwargs)
+        dst[y0:y1] = res[y0 - oy0:y1 - oy0]
+    return None
+
+# ---------- Parent side ----------
+class SharedMemoryExecutor:
+    def __init__(self, workers: int=None):
+        self.workers = workers or os.cpu_count() or 4
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.blocks = BlockPool()
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def empty(self, shape, dtype=np.uint8) -> np.ndarray:
+        # ndarray backed by a pooled shared-memory block; pass it to submit /
+        # run_tiled without any copy, give it back with release()
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        shm = self.blocks.acquire(nbytes)
+        arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        with self._lock:
+            self._leases[arr.ctypes.data] = shm
+        return arr
+
+    def asshared(self, img: np.ndarray) -> np.ndarray:
+        if self._describe(img) is not None:
+            return img
+        arr = self.empty(img.shape, img.dtype)
+        arr[...] = img
+        return arr
+
+    def release(self, arr: np.ndarray):
+        with self._lock:
+            shm = self._leases.pop(arr.ctypes.data, None)
+        if shm is None:
+            raise ValueError("Array was not allocated by this executor (or was already released)")
+        self.blocks.release(shm)
+
+    def _describe(self, arr: np.ndarray):
+        if not arr.flags['C_CONTIGUOUS']:
+            return None
+        shm, offset = self.blocks.find(arr.ctypes.data)
+        if shm is None:
+            return None
+        return ArrayDesc(shm.name, arr.shape, arr.dtype.str, offset)
+
+    def _prepare(self, img, out, out_shape, out_dtype):
+        src = self.asshared(img)
+        temp_src = src is not img
+        if out is None:
+            out = self.empty(out_shape or img.shape, out_dtype or img.dtype)
+        elif self._describe(out) is None:
+            raise ValueError("out must come from empty() so workers can write into it")
+        return src, temp_src, out
+
+    def submit(self, fn, img: np.ndarray, *args, out: np.ndarray=None, out_shape=None,
+               out_dtype=None, **kwargs) -> Future:
+        # Whole image in one worker; use for many images in parallel.
+        # fn must be a module-level function returning one array, or an
+        # OpenCV function taking dst=.
+        temp_out = out is None
+        src, temp_src, out = self._prepare(img, out, out_shape, out_dtype)
+        job = self.pool.submit(_run_task, fn, self._describe(src), self._describe(out), None, 0, args, kwargs)
+        result = Future()
+
+        def done(job):
+            if temp_src:
+                self.release(src)
+            try:
+                job.result()
+            except Exception as e:
+                if temp_out:
+                    self.release(out)
+                result.set_exception(e)
+            else:
+                result.set_result(out)
+        job.add_done_callback(done)
+        return result
+
+    def run_tiled(self, fn, img: np.ndarray, *args, out: np.ndarray=None, halo: int=None,
+                  strips: int=None, **kwargs) -> np.ndarray:
+        # One image split into horizontal strips, each processed with `halo`
+        # rows of context (taken from @roi_aware when not given) so the output
+        # matches a single full-frame call.
+        if halo is None:
+            halo = U.kernel_halo(fn, img, *args, **kwargs)
+        h = img.shape[0]
+        strips = strips or min(self.workers, max(1, h // max(16, 4 * halo)))
+        temp_out = out is None
+        src, temp_src, out = self._prepare(img, out, img.shape, img.dtype)
+        try:
+            src_desc, dst_desc = self._describe(src), self._describe(out)
+            bounds = np.linspace(0, h, strips + 1).astype(int)
+            jobs = [self.pool.submit(_run_task, fn, src_desc, dst_desc, (int(y0), int(y1)), halo, args, kwargs)
+                    for y0, y1 in zip(bounds[:-1], bounds[1:]) if y1 > y0]
+            for job in jobs:
+                job.result()
+        except Exception:
+            if temp_out:
+                self.release(out)
+            raise
+        finally:
+            if temp_src:
+                self.release(src)
+        return out
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+        self.blocks.close()
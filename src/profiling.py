@@ -0,0 +1,216 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+import cv2
+import numpy as np
+from . import filters as F
+from . import enhancement as E
+from . import metrics as M
+
+# Opt-in per-stage timing.
+#
+# enable() swaps every registered function (public filters/enhancement/metrics
+# functions, cv2.cvtColor, and whatever the editor registers) for a traced
+# wrapper; disable() puts the originals back, so nothing is wrapped and
+# nothing is recorded while profiling is off. Each call becomes a span with
+# wall time, self time (minus nested spans), input shape/dtype, output bytes
+# and, with track_memory=True, the net bytes allocated (tracemalloc).
+#
+#   P.enable()
+#   with P.span('apply: Gaussian Blur'):
+#       ...
+#   print(P.last_breakdown())
+#   P.export_chrome_trace('trace.json')    # open in ui.perfetto.dev / chrome://tracing
+#
+# Spans nest per thread. Work handed to another thread is wrapped with
+# propagate(fn) at submit time so its spans count toward the submitting span
+# (pool.map(P.propagate(run), items)). Stages of parallel children add up,
+# so they can exceed the parent's wall time.
+
+_targets = []
+_originals = []
+_events = []
+_lock = threading.Lock()
+_local = threading.local()
+_state = {'enabled': False, 'track_memory': False, 't0': time.perf_counter(), 'last': None}
+
+MAX_EVENTS = 200000
+
+def register(owner, attr: str, label: str=None):
+    # targets registered while enabled (e.g. lazily imported classes) are patched right away
+    if any(o is owner and a == attr for o, a, _ in _targets):
+        return
+    label = label or f'{getattr(owner, "__name__", owner)}.{attr}'
+    _targets.append((owner, attr, label))
+    if _state['enabled']:
+        _patch(owner, attr, label)
+
+def register_module_functions(*modules):
+    # every public function defined in one of `modules`, in every one of
+    # their namespaces (enhancement imports gaussian_filter from filters)
+    defined = {m.__name__ for m in modules}
+    for mod in modules:
+        for name, obj in inspect.getmembers(mod, inspect.isfunction):
+            if not name.startswith('_') and obj.__module__ in defined:
+                register(mod, name, f'{obj.__module__.rsplit(".", 1)[-1]}.{name}')
+
+def is_enabled() -> bool:
+    return _state['enabled']
+
+def is_tracking_memory() -> bool:
+    return _state['enabled'] and _state['track_memory']
+
+def enable(track_memory: bool=False):
+    if _state['enabled']:
+        return
+    _state['track_memory'] = track_memory
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    for owner, attr, label in _targets:
+        _patch(owner, attr, label)
+    _state['enabled'] = True
+
+def _patch(owner, attr: str, label: str):
+    orig = getattr(owner, attr)
+    # inherited methods are overridden on the class and removed again later
+    _originals.append((owner, attr, orig, attr in vars(owner)))
+    setattr(owner, attr, _traced(orig, label))
+
+def disable():
+    if not _state['enabled']:
+        return
+    while _originals:
+        owner, attr, orig, own = _originals.pop()
+        if own:
+            setattr(owner, attr, orig)
+        else:
+            delattr(owner, attr)
+    if _state['track_memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state['enabled'] = False
+
+def clear():
+    with _lock:
+        _events.clear()
+    _state['last'] = None
+
+def _traced(fn, label: str):
+    @functools.wraps(fn)
+    def traced(*args, **kwargs):
+        with _Span(label, args) as sp:
+            res = fn(*args, **kwargs)
+            sp.args['out_bytes'] = _out_bytes(res)
+            return res
+    return traced
+
+def _describe_input(args) -> dict:
+    for a in args:
+        if isinstance(a, np.ndarray):
+            return {'shape': list(a.shape), 'dtype': str(a.dtype)}
+    return {}
+
+def _out_bytes(res) -> int:
+    if isinstance(res, np.ndarray):
+        return int(res.nbytes)
+    if isinstance(res, tuple):
+        return sum(int(r.nbytes) for r in res if isinstance(r, np.ndarray))
+    return 0
+
+class _Span:
+    __slots__ = ('name', 'args', 'start', 'mem0', 'child_us', 'stages')
+
+    def __init__(self, name: str, args=()):
+        self.name = name
+        self.args = _describe_input(args)
+        self.child_us = 0.0
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.stages = stack[0].stages if stack else {}
+        stack.append(self)
+        self.mem0 = tracemalloc.get_traced_memory()[0] if _state['track_memory'] else 0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        stack = _local.stack
+        stack.pop()
+        dur_us = (end - self.start) * 1e6
+        args = dict(self.args)
+        if _state['track_memory']:
+            args['alloc_bytes'] = int(tracemalloc.get_traced_memory()[0] - self.mem0)
+        self_us = max(0.0, dur_us - self.child_us)
+        event = {'name': self.name, 'ph': 'X', 'ts': (self.start - _state['t0']) * 1e6, 'dur': dur_us,
+                 'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args}
+        # stages and the parent may be shared with spans in other threads
+        with _lock:
+            self.stages[self.name] = self.stages.get(self.name, 0.0) + self_us
+            if stack:
+                stack[-1].child_us += dur_us
+            if len(_events) < MAX_EVENTS:
+                _events.append(event)
+        if not stack:
+            stages = sorted(((n, us / 1000.0) for n, us in self.stages.items()), key=lambda s: -s[1])
+            _state['last'] = {'name': self.name, 'total_ms': dur_us / 1000.0, 'stages': stages, **args}
+        return False
+
+def span(name: str, *arrays):
+    # Explicit span for code that is not a registered function; a no-op
+    # context manager while profiling is disabled.
+    if not _state['enabled']:
+        return nullcontext()
+    return _Span(name, arrays)
+
+def propagate(fn):
+    # Wraps fn to run in another thread under the span open here; fn itself
+    # when profiling is off or no span is open.
+    stack = getattr(_local, 'stack', None)
+    if not _state['enabled'] or not stack:
+        return fn
+    parent = stack[-1]
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        saved = getattr(_local, 'stack', None)
+        _local.stack = [parent]
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.stack = saved
+    return run
+
+def last_breakdown():
+    # {'name', 'total_ms', 'stages': [(stage, self_ms), ...]} for the last top-level span
+    return _state['last']
+
+def format_breakdown(b: dict, top: int=5) -> str:
+    if not b:
+        return ''
+    # the top-level span's own self time is whatever no stage accounts for
+    parts = [f"{'other' if name == b['name'] else name} {ms:.1f} ms" for name, ms in b['stages'][:top]]
+    if 'alloc_bytes' in b:
+        parts.append(f"net alloc {b['alloc_bytes'] / 2**20:.1f} MiB")
+    return f"{b['name']}: {b['total_ms']:.1f} ms  —  " + ' · '.join(parts)
+
+def events() -> list:
+    with _lock:
+        return list(_events)
+
+def export_chrome_trace(path: str):
+    evs = events()
+    meta = [{'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'args': {'name': 'Mini Photo Editor'}}]
+    for t in threading.enumerate():
+        meta.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': t.ident, 'args': {'name': t.name}})
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': meta + evs, 'displayTimeUnit': 'ms'}, f)
+
+register_module_functions(F, E, M)
+register(cv2, 'cvtColor', 'cv2.cvtColor')
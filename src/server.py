@@ -0,0 +1,323 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import cv2
+import numpy as np
+from . import operations as O
+
+# Local HTTP processing service for the same operations as the editor menu.
+#
+#   python -m src.server --port 8765
+#   curl --data-binary @data/lena.jpg "http://127.0.0.1:8765/process?op=Gaussian%20Blur&k=9&sigma=3" -o out.png
+#   curl http://127.0.0.1:8765/stats
+#
+# Requests go through a bounded queue (full -> 503 + Retry-After). A dispatcher
+# thread drains it, groups requests that share (op, params) within a short
+# window, splits each group over the workers and hands the batches to the
+# pool, where decode -> op -> encode happens. Batches only grow past one
+# request once every worker has one; then a single pool task (and one pickle
+# round trip in process mode) serves several small images.
+
+ENCODINGS = {'png': '.png', 'jpg': '.jpg', 'jpeg': '.jpg', 'bmp': '.bmp'}
+CONTENT_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.bmp': 'image/bmp'}
+
+class QueueFull(Exception):
+    pass
+
+def parse_params(query: dict) -> dict:
+    get = lambda name, default: query.get(name, [default])[0]
+    spec = O.get_operation(get('op', None))
+    fmt = get('format', 'png').lower()
+    if fmt not in ENCODINGS:
+        raise ValueError(f"Unsupported output format: {fmt!r}")
+    roi = get('roi', None)
+    if roi is not None:
+        roi = tuple(int(v) for v in roi.split(','))
+        if len(roi) != 4:
+            raise ValueError("roi must be x,y,w,h")
+    backend = get('backend', None)
+    if backend is not None and backend not in spec.backends:
+        raise ValueError(f"Unknown backend {backend!r} for {spec.name}; expected one of {list(spec.backends)}")
+    # validated against the registry; params the op does not declare keep their defaults
+    values = {'k': get('k', None), 'sigma': get('sigma', None), 't1': get('t1', None),
+              't2': get('t2', None), 'blur_mode': get('mode', None)}
+    bound = spec.bind(**values)
+    params = {'op': spec.name, 'roi': roi, 'backend': backend, 'ext': ENCODINGS[fmt]}
+    params.update({k: v for k, v in bound.items() if values[k] is not None})
+    return params
+
+def process_batch(params: dict, blobs: list) -> list:
+    # Runs inside a worker (thread or process). Returns one (ok, payload) per
+    # blob so a bad image only fails its own request.
+    p = dict(params)
+    ext = p.pop('ext')
+    op = p.pop('op')
+    # gray-only ops decode straight to gray (no color decode, no cvtColor)
+    # and return a single-channel image
+    decode_gray = O.get_operation(op).gray and p.get('roi') is None
+    results = []
+    for data in blobs:
+        try:
+            flags = cv2.IMREAD_GRAYSCALE if decode_gray else cv2.IMREAD_COLOR
+            img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+            if img is None:
+                raise ValueError("Failed to decode image")
+            if img.ndim == 3:
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            out = O.run_operation(op, img, as_rgb=False, **p)
+            if out.ndim == 3:
+                out = cv2.cvtColor(out, cv2.COLOR_RGB2BGR)
+            ok, buf = cv2.imencode(ext, out)
+            if not ok:
+                raise ValueError(f"Failed to encode result as {ext}")
+            results.append((True, buf.tobytes()))
+        except Exception as e:
+            results.append((False, str(e)))
+    return results
+
+class Stats:
+    def __init__(self, window: int=10000):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.latencies = deque(maxlen=window)
+        self.done_at = deque(maxlen=window)
+        self.counters = {
+            'requests': 0, 'completed': 0, 'failed': 0, 'rejected': 0,
+            'batches': 0, 'batched_requests': 0, 'bytes_in': 0, 'bytes_out': 0,
+        }
+
+    def incr(self, name: str, n: int=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def record(self, latency_s: float, ok: bool, bytes_out: int=0):
+        with self.lock:
+            self.counters['completed' if ok else 'failed'] += 1
+            self.counters['bytes_out'] += bytes_out
+            self.latencies.append(latency_s * 1000.0)
+            self.done_at.append(time.time())
+
+    def snapshot(self, queue_depth: int=0) -> dict:
+        with self.lock:
+            lat = np.array(self.latencies, dtype=np.float64)
+            now = time.time()
+            recent = sum(1 for t in self.done_at if now - t <= 60.0)
+            uptime = now - self.started
+            out = dict(self.counters)
+        out['uptime_s'] = round(uptime, 3)
+        out['queue_depth'] = queue_depth
+        out['throughput_rps'] = round(out['completed'] / uptime, 3) if uptime > 0 else 0.0
+        out['throughput_rps_1m'] = round(recent / min(60.0, uptime), 3) if uptime > 0 else 0.0
+        out['mean_batch_size'] = round(out['batched_requests'] / out['batches'], 3) if out['batches'] else 0.0
+        if lat.size:
+            p50, p90, p99 = np.percentile(lat, [50, 90, 99])
+            out['latency_ms'] = {'p50': round(float(p50), 3), 'p90': round(float(p90), 3),
+                                 'p99': round(float(p99), 3), 'max': round(float(lat.max()), 3),
+                                 'samples': int(lat.size)}
+        else:
+            out['latency_ms'] = {}
+        return out
+
+class ProcessingService:
+    def __init__(self, workers: int=4, use_processes: bool=False, max_queue: int=64,
+                 batch_window_ms: float=5.0, max_batch: int=8, small_bytes: int=256 * 1024):
+        pool_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self.pool = pool_cls(max_workers=workers)
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=max_queue)
+        # caps batches handed to the pool so the queue (and 503s) absorb overload
+        self.in_flight = threading.BoundedSemaphore(workers * 2)
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch = max_batch
+        self.small_bytes = small_bytes
+        self.stats = Stats()
+        self._stop = threading.Event()
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name='dispatcher', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, params: dict, data: bytes) -> Future:
+        fut = Future()
+        self.stats.incr('requests')
+        self.stats.incr('bytes_in', len(data))
+        try:
+            self.queue.put_nowait((params, data, fut))
+        except queue.Full:
+            self.stats.incr('rejected')
+            raise QueueFull()
+        return fut
+
+    def _key(self, params: dict):
+        return tuple(sorted(params.items()))
+
+    def _collect(self):
+        try:
+            first = self.queue.get(timeout=0.2)
+        except queue.Empty:
+            return []
+        items = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(items) < self.max_batch * 4:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _dispatch_loop(self):
+        while not self._stop.is_set():
+            groups = {}
+            for params, data, fut in self._collect():
+                if len(data) > self.small_bytes:
+                    # large images gain nothing from batching; run them alone
+                    groups.setdefault((id(fut),), (params, []))[1].append((data, fut))
+                else:
+                    groups.setdefault(self._key(params), (params, []))[1].append((data, fut))
+            for params, items in groups.values():
+                # spread a group over the workers first; only requests beyond
+                # one per worker share a task (at most max_batch each)
+                size = min(self.max_batch, -(-len(items) // self.workers))
+                for i in range(0, len(items), size):
+                    self._submit_batch(params, items[i:i + size])
+
+    def _submit_batch(self, params: dict, items: list):
+        self.in_flight.acquire()
+        self.stats.incr('batches')
+        self.stats.incr('batched_requests', len(items))
+        try:
+            job = self.pool.submit(process_batch, params, [data for data, _ in items])
+        except Exception as e:
+            self.in_flight.release()
+            for _, fut in items:
+                fut.set_exception(e)
+            return
+
+        def done(job):
+            self.in_flight.release()
+            try:
+                results = job.result()
+            except Exception as e:
+                for _, fut in items:
+                    fut.set_exception(e)
+                return
+            for (_, fut), res in zip(items, results):
+                fut.set_result(res)
+        job.add_done_callback(done)
+
+    def shutdown(self):
+        self._stop.set()
+        self._dispatcher.join()
+        self.pool.shutdown(wait=True)
+
+class Handler(BaseHTTPRequestHandler):
+    service = None
+    timeout_s = 120.0
+
+    def _send(self, code: int, body: bytes, content_type: str, headers: dict=None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, code: int, obj, headers: dict=None):
+        self._send(code, json.dumps(obj, indent=2).encode('utf-8'), 'application/json', headers)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/stats':
+            self._send_json(200, self.service.stats.snapshot(self.service.queue.qsize()))
+        elif path == '/operations':
+            self._send_json(200, {'operations': O.describe_operations()})
+        elif path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': f'Not found: {path}'})
+
+    def do_POST(self):
+        t0 = time.perf_counter()
+        url = urlparse(self.path)
+        if url.path != '/process':
+            self._send_json(404, {'error': f'Not found: {url.path}'})
+            return
+        try:
+            params = parse_params(parse_qs(url.query))
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        if length <= 0:
+            self._send_json(400, {'error': 'Empty request body; send the image bytes'})
+            return
+        data = self.rfile.read(length)
+        try:
+            fut = self.service.submit(params, data)
+        except QueueFull:
+            self._send_json(503, {'error': 'Server busy, retry later'}, {'Retry-After': '1'})
+            return
+        try:
+            ok, payload = fut.result(timeout=self.timeout_s)
+        except FutureTimeout:
+            self.service.stats.record(time.perf_counter() - t0, False)
+            self._send_json(504, {'error': f'Processing did not finish within {self.timeout_s:g} s'})
+            return
+        except Exception as e:
+            ok, payload = False, str(e) or type(e).__name__
+        if ok:
+            self.service.stats.record(time.perf_counter() - t0, True, len(payload))
+            self._send(200, payload, CONTENT_TYPES[params['ext']])
+        else:
+            self.service.stats.record(time.perf_counter() - t0, False)
+            self._send_json(422, {'error': payload})
+
+    def log_message(self, format, *args):
+        pass
+
+class ServiceHTTPServer(ThreadingHTTPServer):
+    # listen backlog of at least the queue size, so overload is answered with
+    # 503 instead of connection resets (the stdlib default backlog is 5)
+    def __init__(self, address, handler, backlog: int=128):
+        self.request_queue_size = backlog
+        super().__init__(address, handler)
+
+def main():
+    parser = argparse.ArgumentParser(description='Local HTTP image processing service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--processes', action='store_true', help='use a process pool instead of threads')
+    parser.add_argument('--max-queue', type=int, default=64)
+    parser.add_argument('--batch-window-ms', type=float, default=5.0)
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    service = ProcessingService(workers=args.workers, use_processes=args.processes,
+                                max_queue=args.max_queue, batch_window_ms=args.batch_window_ms,
+                                max_batch=args.max_batch)
+    Handler.service = service
+    if args.verbose:
+        Handler.log_message = BaseHTTPRequestHandler.log_message
+    httpd = ServiceHTTPServer((args.host, args.port), Handler, backlog=max(args.max_queue, 128))
+    print(f'Serving on http://{args.host}:{args.port} (workers={args.workers}, '
+          f'{"processes" if args.processes else "threads"})')
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.shutdown()
+
+if __name__ == '__main__':
+    main()
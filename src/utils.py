@@ -1,5 +1,7 @@
 
 import os
+import functools
+import inspect
 import cv2
 import numpy as np
 from typing import Tuple
@@ -51,3 +53,68 @@ def im2float(img: np.ndarray) -> np.ndarray:
 
 def pad_to_odd(k: int) -> int:
     return k if k % 2 == 1 else k + 1
+
+# ---------- Region of interest ----------
+# ROI is (x, y, w, h) in pixel coordinates, same convention as cv2/QRect.
+def clip_roi(roi, shape) -> Tuple[int, int, int, int]:
+    x, y, w, h = (int(v) for v in roi)
+    H, W = shape[:2]
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(W, x + w), min(H, y + h)
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"ROI {tuple(roi)} does not intersect image of size {W}x{H}")
+    return x0, y0, x1 - x0, y1 - y0
+
+def run_on_roi(fn, img: np.ndarray, roi, halo: int=0):
+    # Run fn on the ROI plus `halo` pixels of context (clamped to the image) so
+    # the kernel sees the same neighbourhood as on the full frame, then paste
+    # only the ROI back. Everything outside the ROI is left untouched.
+    x, y, w, h = clip_roi(roi, img.shape)
+    H, W = img.shape[:2]
+    halo = max(0, int(halo))
+    ox0, oy0 = max(0, x - halo), max(0, y - halo)
+    ox1, oy1 = min(W, x + w + halo), min(H, y + h + halo)
+    patch = np.ascontiguousarray(img[oy0:oy1, ox0:ox1])
+    res = fn(patch)
+    inner = (slice(y - oy0, y - oy0 + h), slice(x - ox0, x - ox0 + w))
+
+    def paste(r):
+        if r.dtype == img.dtype and r.shape[2:] == img.shape[2:]:
+            out = img.copy()
+        else:
+            out = np.zeros((H, W) + r.shape[2:], dtype=r.dtype)
+        out[y:y+h, x:x+w] = r[inner]
+        return out
+
+    if isinstance(res, tuple):
+        return tuple(paste(r) for r in res)
+    return paste(res)
+
+def resolve_halo(halo, sig, img, args, kwargs) -> int:
+    if callable(halo):
+        bound = sig.bind(img, *args, **kwargs)
+        bound.apply_defaults()
+        return int(halo(bound.arguments))
+    return int(halo)
+
+def kernel_halo(fn, img, *args, **kwargs) -> int:
+    # Halo a @roi_aware function needs for these arguments
+    if not hasattr(fn, 'roi_halo'):
+        raise ValueError(f"{getattr(fn, '__name__', fn)} does not declare a halo; pass halo= explicitly")
+    return resolve_halo(fn.roi_halo, inspect.signature(fn), img, args, kwargs)
+
+def roi_aware(halo):
+    # Adds a keyword-only `roi=` argument to an image function. `halo` is the
+    # kernel radius: an int, or a callable receiving the bound arguments.
+    def decorate(fn):
+        sig = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(img, *args, roi=None, **kwargs):
+            if roi is None:
+                return fn(img, *args, **kwargs)
+            h = resolve_halo(halo, sig, img, args, kwargs)
+            return run_on_roi(lambda patch: fn(patch, *args, **kwargs), img, roi, h)
+        wrapper.roi_halo = halo
+        return wrapper
+    return decorate